@@ -0,0 +1,28 @@
+"""
+Compare memory usage and groupby speed of the loaded corpus with and without compact dtypes.
+"""
+
+import pandas as pd
+
+import config as c
+
+
+def time_groupby(df, keys):
+    """Return the best time (in ms) of grouping by keys and averaging word counts."""
+    return c.best_time(lambda: df.groupby(keys, observed=True)["wordcount"].mean()) * 1000
+
+
+results = {}
+for compact in [False, True]:
+    posts = c.load_dreamviews_posts(compact=compact)
+    users = c.load_dreamviews_users(compact=compact)
+    results["compact" if compact else "object"] = {
+        "posts_MB": posts.memory_usage(deep=True).sum() / 1e6,
+        "users_MB": users.memory_usage(deep=True).sum() / 1e6,
+        "groupby_user_ms": time_groupby(posts, "user_id"),
+        "groupby_user_lucidity_ms": time_groupby(posts, ["user_id", "lucidity"]),
+    }
+
+results = pd.DataFrame(results)
+results["ratio"] = results["object"] / results["compact"]
+print(results.round(2).to_string())
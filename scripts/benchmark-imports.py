@@ -0,0 +1,61 @@
+"""
+Measure the import time of each script with ``python -X importtime``.
+
+Only the top-level import statements of each script are run (in a fresh interpreter),
+so this measures the startup cost each script pays before doing any work.
+"""
+
+import argparse
+import ast
+import subprocess
+import sys
+from pathlib import Path
+
+parser = argparse.ArgumentParser()
+parser.add_argument("scripts", nargs="*", help="Scripts to measure. Defaults to all of them.")
+parser.add_argument("-n", "--top", type=int, default=3, help="Number of slowest imports to list.")
+args = parser.parse_args()
+
+SKIP_SCRIPTS = ["runall.py", "cmap2hex.py"]
+
+if args.scripts:
+    script_paths = [Path(s) for s in args.scripts]
+else:
+    script_paths = sorted(Path(__file__).parent.glob("*.py"))
+    script_paths = [p for p in script_paths if not p.name.startswith(("benchmark-", "config"))]
+    script_paths = [p for p in script_paths if p.name not in SKIP_SCRIPTS]
+
+
+def get_import_source(script_path):
+    """Return the source code of all top-level import statements in a script."""
+    tree = ast.parse(script_path.read_text(encoding="utf-8"))
+    imports = [node for node in tree.body if isinstance(node, ast.Import | ast.ImportFrom)]
+    return "\n".join(ast.unparse(node) for node in imports)
+
+
+def measure_imports(source, cwd):
+    """Return cumulative import times (in ms) of each top-level module imported by source."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", source], cwd=cwd, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise ImportError(result.stderr.strip().splitlines()[-1])
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.removeprefix("import time:").split("|")
+        if not module.startswith("   "):  # Nested imports are indented further
+            times[module.strip()] = int(cumulative) / 1000
+    return times
+
+
+for script_path in script_paths:
+    try:
+        times = measure_imports(get_import_source(script_path), cwd=script_path.parent)
+    except ImportError as error:
+        print(f"{script_path.name:<32} failed ({error})")
+        continue
+    slowest = sorted(times.items(), key=lambda x: x[1], reverse=True)[: args.top]
+    slowest_txt = ", ".join(f"{module} {ms:.0f}" for module, ms in slowest)
+    print(f"{script_path.name:<32} {sum(times.values()):>8.0f} ms  ({slowest_txt})")
@@ -0,0 +1,55 @@
+"""
+Compare the per-token loop that used to filter lemmas with the vectorized ``c.filter_lemmas``.
+
+Both are timed on the same docs (parsed once beforehand) and checked to give the same lemmas.
+"""
+
+import argparse
+
+import numpy as np
+import spacy
+
+import config as c
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--n-posts", type=int, default=500, help="Number of posts to time.")
+args = parser.parse_args()
+
+
+def filter_lemmas_loop(doc, pos_remove_list=None):
+    """The original token filter, checking each token's attributes in Python."""
+    if pos_remove_list is None:
+        pos_remove_list = ["PROPN", "SMY"]
+    token_list = []
+    for token in doc:
+        if (
+            (token.is_alpha)
+            and (len(token) >= 3)
+            and (not token.like_email)
+            and (not token.like_url)
+            and (not token.like_num)
+            and (not token.is_stop)
+            and (not token.is_oov)
+            and (token.pos_ not in pos_remove_list)
+        ):
+            token_list.append(token.lemma_.lower())
+    return token_list
+
+
+def time_per_doc(function, docs):
+    """Return the best time (in microseconds) of filtering each doc, averaged over docs."""
+    return c.best_time(lambda: [function(doc) for doc in docs]) / len(docs) * 1e6
+
+
+nlp = spacy.load(c.SPACY_MODEL)
+nlp.add_pipe("merge_entities")
+store = c.load_post_text_store()
+docs = list(nlp.pipe(store.sample(args.n_posts, random_state=91).tolist()))
+
+mismatches = sum(filter_lemmas_loop(doc) != c.filter_lemmas(doc) for doc in docs)
+loop_us = time_per_doc(filter_lemmas_loop, docs)
+vectorized_us = time_per_doc(c.filter_lemmas, docs)
+n_tokens = np.mean([len(doc) for doc in docs])
+print(f"{len(docs)} docs ({n_tokens:.0f} tokens on average), {mismatches} with different lemmas")
+print(f"loop:       {loop_us:>8.1f} us/doc")
+print(f"vectorized: {vectorized_us:>8.1f} us/doc ({loop_us / vectorized_us:.1f}x faster)")
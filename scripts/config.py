@@ -1,12 +1,22 @@
+import atexit
+import hashlib
+import io
+import json
+import mmap
 import os
+import pickle
+import sys
+import time
 from pathlib import Path
 
-import pandas as pd
-import pooch
-from dotenv import load_dotenv
-from matplotlib.pyplot import rcParams
+# Heavy dependencies (numpy, scipy, pandas, pooch, python-dotenv, matplotlib) are imported
+# inside the functions that need them, since every script imports this module at startup.
 
-load_dotenv()
+# Re-hash local files on every fetch instead of trusting previously verified files
+PARANOID = os.environ.get("DREAMVIEWS_PARANOID", "0") == "1"
+
+# Render exported figures in background worker processes, which are waited for at exit
+BACKGROUND_EXPORT = os.environ.get("DREAMVIEWS_BACKGROUND_EXPORT", "0") == "1"
 
 OUTPUT_DIR = "../output"
 MANUSCRIPT_DIR = "../manuscript"
@@ -19,12 +29,16 @@ raw_dir = output_dir / "raw"
 derivatives_dir = output_dir / "derivatives"
 tables_dir = output_dir / "tables"
 figures_dir = output_dir / "figures"
+cache_dir = output_dir / "cache"
 
 sourcedata_dir.mkdir(parents=True, exist_ok=True)
 raw_dir.mkdir(parents=True, exist_ok=True)
 derivatives_dir.mkdir(parents=True, exist_ok=True)
 tables_dir.mkdir(parents=True, exist_ok=True)
 figures_dir.mkdir(parents=True, exist_ok=True)
+cache_dir.mkdir(parents=True, exist_ok=True)
+
+verified_files_path = cache_dir / "verified-files.json"
 
 SPACY_MODEL = "en_core_web_lg"
 
@@ -61,6 +75,22 @@ RAW_REGISTRY = {
     },
 }
 
+# Compact dtypes applied by the loaders (repeated strings become categoricals)
+POSTS_DTYPES = {
+    "user_id": "category",
+    "nth_post": "int32",
+    "tags": "category",
+    "categories": "category",
+    "lucidity": "category",
+    "wordcount": "int32",
+}
+
+USERS_DTYPES = {
+    "gender": "category",
+    "age": "category",
+    "country": "category",
+}
+
 SOURCE_REGISTRY = {
     "v1": {
         "doi": "10.5281/zenodo.19040637",
@@ -73,7 +103,47 @@ SOURCE_REGISTRY = {
 }
 
 
+def _temp_path(filepath):
+    # Unique per process, since pipeline steps running concurrently may write the same file
+    return filepath.with_name(f"{filepath.name}.{os.getpid()}.tmp")
+
+
+def _file_signature(filepath):
+    stat = filepath.stat()
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def _load_verified_files():
+    if not verified_files_path.exists():
+        return {}
+    with open(verified_files_path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _is_verified(filepath, known_hash):
+    # A file that passed a hash check is trusted until its size, mtime, or inode changes
+    if PARANOID or not filepath.exists():
+        return False
+    record = _load_verified_files().get(filepath.resolve().as_posix())
+    return record == {"known_hash": known_hash, "signature": _file_signature(filepath)}
+
+
+def _record_verified(filepath, known_hash):
+    verified = _load_verified_files()
+    record = {"known_hash": known_hash, "signature": _file_signature(filepath)}
+    verified[filepath.resolve().as_posix()] = record
+    temp_path = _temp_path(verified_files_path)
+    with open(temp_path, "wt", encoding="utf-8") as f:
+        json.dump(verified, f, indent=4, sort_keys=True)
+    temp_path.replace(verified_files_path)
+
+
 def fetch_deriv_file(filename):
+    known_hash = DERIVATIVES_REGISTRY[filename]["known_hash"]
+    if _is_verified(derivatives_dir / filename, known_hash):
+        return derivatives_dir / filename
+    import pooch
+
     fetcher = pooch.create(
         path=derivatives_dir,
         base_url="",
@@ -81,7 +151,9 @@ def fetch_deriv_file(filename):
         urls={k: v["url"] for k, v in DERIVATIVES_REGISTRY.items()},
         allow_updates=False,
     )
-    return Path(fetcher.fetch(filename))
+    filepath = Path(fetcher.fetch(filename))
+    _record_verified(filepath, known_hash)
+    return filepath
 
 
 def _zenodo_doi_to_pooch_url(doi, as_doi_url=False):
@@ -94,15 +166,26 @@ def _zenodo_doi_to_pooch_url(doi, as_doi_url=False):
 def fetch_raw_file(filename, version):
     assert version in RAW_REGISTRY, f"Version {version} not found in RAW_REGISTRY"
     registry = RAW_REGISTRY[version]["files"]
+    if _is_verified(raw_dir / filename, registry[filename]):
+        return raw_dir / filename
+    import pooch
+
     doi = RAW_REGISTRY[version]["doi"]
     base_url = _zenodo_doi_to_pooch_url(doi, as_doi_url=True)
     fetcher = pooch.create(path=raw_dir, base_url=base_url, registry=registry, allow_updates=False)
-    return Path(fetcher.fetch(filename, progressbar=True))
+    filepath = Path(fetcher.fetch(filename, progressbar=True))
+    _record_verified(filepath, registry[filename])
+    return filepath
 
 
 def fetch_source_file(filename, version):
     assert version in SOURCE_REGISTRY, f"Version {version} not found in SOURCE_REGISTRY"
     registry = SOURCE_REGISTRY[version]["files"]
+    if _is_verified(sourcedata_dir / filename, registry[filename]):
+        return sourcedata_dir / filename
+    import pooch
+    from dotenv import load_dotenv
+
     doi = SOURCE_REGISTRY[version]["doi"]
     # Accessing restricted files requires using the API with an access token.
     # The URL for fetching a specific file is different and has a suffix after the filename
@@ -115,20 +198,57 @@ def fetch_source_file(filename, version):
         path=sourcedata_dir, base_url="", registry=registry, urls=urls, allow_updates=False
     )
     # Create authorized downloader
+    load_dotenv()
     token = os.environ.get("ZENODO_TOKEN")
     authorization = f"Bearer {token}"
     downloader = pooch.HTTPDownloader(headers={"Authorization": authorization}, progressbar=True)
-    return Path(fetcher.fetch(filename, downloader=downloader))
+    filepath = Path(fetcher.fetch(filename, downloader=downloader))
+    _record_verified(filepath, registry[filename])
+    return filepath
+
+
+def _compact_dtypes(dataframe, dtypes):
+    dtypes = {col: dtype for col, dtype in dtypes.items() if col in dataframe}
+    return dataframe.astype(dtypes)
+
 
+# Frames loaded ahead of time by preload_corpus, served by the loaders instead of rereading
+_preloaded = {}
 
-def load_dreamviews_users(version="v1"):
+
+def load_dreamviews_users(version="v1", compact=True):
+    import pandas as pd
+
+    if ("users", version, compact) in _preloaded:
+        return _preloaded["users", version, compact]
     filepath = fetch_raw_file("dreamviews-users.tsv", version)
     users = pd.read_csv(filepath, sep="\t", encoding="ascii")
+    if compact:
+        users = _compact_dtypes(users, USERS_DTYPES)
     return users
 
 
-def load_dreamviews_posts(lemmas=False, version="v1"):
-    filepath = fetch_raw_file("dreamviews-posts.tsv", version)
+def _file_md5(filepath, chunksize=2**20):
+    md5 = hashlib.md5()
+    with open(filepath, "rb") as f:
+        while chunk := f.read(chunksize):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _cached_md5(filepath):
+    # Generated files are only rehashed when their size, mtime, or inode changed (like fetches)
+    record = _load_verified_files().get(filepath.resolve().as_posix())
+    if not PARANOID and record is not None and record["signature"] == _file_signature(filepath):
+        return record["known_hash"].removeprefix("md5:")
+    md5 = _file_md5(filepath)
+    _record_verified(filepath, f"md5:{md5}")
+    return md5
+
+
+def _read_dreamviews_posts(filepath, lemmas=False):
+    import pandas as pd
+
     posts = pd.read_csv(filepath, sep="\t", encoding="ascii", parse_dates=["timestamp"])
     if lemmas:
         lemmas_fpath = derivatives_dir / "lemmas.tsv"
@@ -137,6 +257,217 @@ def load_dreamviews_posts(lemmas=False, version="v1"):
     return posts
 
 
+def _posts_cache_key(version, lemmas=False):
+    cache_key = RAW_REGISTRY[version]["files"]["dreamviews-posts.tsv"].removeprefix("md5:")
+    if lemmas:
+        cache_key += "-" + _cached_md5(derivatives_dir / "lemmas.tsv")
+    return cache_key
+
+
+def load_dreamviews_posts(lemmas=False, version="v1", columns=None, cache=True, compact=True):
+    # Parsed posts are cached as parquet, keyed by the md5 of the posts (and lemmas) file
+    import pandas as pd
+
+    filepath = fetch_raw_file("dreamviews-posts.tsv", version)
+    if columns is not None:
+        columns = list(columns)
+        if lemmas and "post_lemmas" not in columns:
+            columns.append("post_lemmas")
+    if not cache:
+        posts = _read_dreamviews_posts(filepath, lemmas=lemmas)
+        if columns is not None:
+            posts = posts[columns]
+        return _compact_dtypes(posts, POSTS_DTYPES) if compact else posts
+    cache_stem = "dreamviews-posts-lemmas" if lemmas else "dreamviews-posts"
+    cache_key = _posts_cache_key(version, lemmas=lemmas)
+    preload_key = ("posts", version, compact, lemmas, cache_key)
+    if preload_key in _preloaded:
+        posts = _preloaded[preload_key]
+        return posts if columns is None else posts[columns]
+    cache_path = cache_dir / f"{cache_stem}_{cache_key}.parquet"
+    if not cache_path.exists():
+        posts = _read_dreamviews_posts(filepath, lemmas=lemmas)
+        # Remove outdated caches before writing (via a temporary file, to stay atomic)
+        for stale_path in cache_dir.glob(f"{cache_stem}_*.parquet"):
+            if stale_path != cache_path:
+                stale_path.unlink(missing_ok=True)
+        temp_path = _temp_path(cache_path)
+        posts.to_parquet(temp_path, index=False)
+        temp_path.replace(cache_path)
+    posts = pd.read_parquet(cache_path, columns=columns)
+    return _compact_dtypes(posts, POSTS_DTYPES) if compact else posts
+
+
+def preload_corpus(version="v1", compact=True):
+    # Load the posts, users, and lemmas once, for --warm steps forked from this process to reuse
+    preload_keys = [("users", version, compact)]
+    if raw_dir.joinpath("dreamviews-users.tsv").exists():
+        _preloaded[preload_keys[0]] = load_dreamviews_users(version=version, compact=compact)
+    if raw_dir.joinpath("dreamviews-posts.tsv").exists():
+        lemma_options = [False]
+        if derivatives_dir.joinpath("lemmas.tsv").exists():
+            lemma_options.append(True)
+        for lemmas in lemma_options:
+            cache_key = _posts_cache_key(version, lemmas=lemmas)
+            preload_key = ("posts", version, compact, lemmas, cache_key)
+            _preloaded[preload_key] = load_dreamviews_posts(lemmas, version, compact=compact)
+            preload_keys.append(preload_key)
+    for key in set(_preloaded) - set(preload_keys):
+        del _preloaded[key]
+
+
+def iter_dreamviews_posts(chunksize=10_000, columns=None, lemmas=False, version="v1"):
+    # Stream chunks of posts (with their lemmas), for corpora that don't fit in memory
+    import pandas as pd
+
+    filepath = fetch_raw_file("dreamviews-posts.tsv", version)
+    read_kwargs = {"sep": "\t", "encoding": "ascii", "chunksize": chunksize}
+    if columns is not None:
+        columns = [col for col in columns if col != "post_lemmas"]
+        read_kwargs["usecols"] = list({"post_id", *columns}) if lemmas else columns
+    if columns is None or "timestamp" in columns:
+        read_kwargs["parse_dates"] = ["timestamp"]
+    if lemmas and columns is not None:
+        columns.append("post_lemmas")
+    with pd.read_csv(filepath, **read_kwargs) as posts_reader:
+        if not lemmas:
+            for posts in posts_reader:
+                yield posts if columns is None else posts[columns]
+            return
+        lemmas_path = derivatives_dir / "lemmas.tsv"
+        lemmas_kwargs = {"sep": "\t", "encoding": "ascii", "chunksize": chunksize}
+        with pd.read_csv(lemmas_path, **lemmas_kwargs) as lemmas_reader:
+            pending = next(lemmas_reader)
+            for posts in posts_reader:
+                # Buffer lemmas until they reach past the current chunk of posts
+                while pending["post_id"].isin(posts["post_id"]).all():
+                    next_lemmas = next(lemmas_reader, None)
+                    if next_lemmas is None:
+                        break
+                    pending = pd.concat([pending, next_lemmas], ignore_index=True)
+                # Lemmas of the current chunk are the leading run of buffered lemmas
+                is_current = pending["post_id"].isin(posts["post_id"]).to_numpy()
+                n_current = is_current.cumprod().sum()
+                current, pending = pending.iloc[:n_current], pending.iloc[n_current:]
+                posts = posts.merge(current, on="post_id", how="inner", validate="one_to_one")
+                yield posts if columns is None else posts[columns]
+            if not pending.empty or next(lemmas_reader, None) is not None:
+                raise ValueError("Lemmas are not in the same order as the posts.")
+
+
+# Memory-mapped texts of one posts column, located by offsets for random access by post ID
+class PostTextStore:
+    def __init__(self, text_path, offsets_path, post_ids_path):
+        import numpy as np
+
+        with open(text_path, "rb") as f:  # The memory map stays valid after closing the file
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        self.post_ids = np.load(post_ids_path)
+        self.rows = {post_id: i for i, post_id in enumerate(self.post_ids.tolist())}
+
+    def __len__(self):
+        return len(self.post_ids)
+
+    def __getitem__(self, post_id):
+        return self.get_bytes(post_id).tobytes().decode("utf-8")
+
+    def get_bytes(self, post_id):
+        # Zero-copy view of the encoded text
+        row = self.rows[post_id]
+        return memoryview(self._buffer)[self.offsets[row] : self.offsets[row + 1]]
+
+    def read(self, post_ids):
+        import pandas as pd
+
+        return pd.Series([self[post_id] for post_id in post_ids], index=pd.Index(post_ids))
+
+    def sample(self, n, random_state=None):
+        import numpy as np
+
+        rng = np.random.default_rng(random_state)
+        rows = rng.choice(len(self), size=n, replace=False)
+        return self.read(self.post_ids[rows].tolist())
+
+    def close(self):
+        self._buffer.close()
+
+
+def load_post_text_store(column="post_text", version="v1"):
+    # Build the store of post_text or post_lemmas once per posts (and lemmas) file
+    import numpy as np
+
+    assert column in ["post_text", "post_lemmas"], f"Can't store column {column}"
+    lemmas = column == "post_lemmas"
+    store_stem = f"{column}-store"
+    store_key = _posts_cache_key(version, lemmas=lemmas)
+    text_path = cache_dir / f"{store_stem}_{store_key}.txt"
+    offsets_path = cache_dir / f"{store_stem}_{store_key}_offsets.npy"
+    post_ids_path = cache_dir / f"{store_stem}_{store_key}_post-ids.npy"
+    if not text_path.exists():
+        posts = load_dreamviews_posts(lemmas=lemmas, version=version, columns=["post_id", column])
+        encoded = [text.encode("utf-8") for text in posts[column]]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded], out=offsets[1:])
+        for stale_path in cache_dir.glob(f"{store_stem}_*"):
+            if store_key not in stale_path.name:
+                stale_path.unlink(missing_ok=True)
+        # Write each file atomically, and the text file last since it marks the store as complete
+        post_ids = posts["post_id"].to_numpy(dtype=str)
+        for path, array in [(offsets_path, offsets), (post_ids_path, post_ids)]:
+            temp_path = _temp_path(path)
+            with open(temp_path, "wb") as f:
+                np.save(f, array)
+            temp_path.replace(path)
+        temp_path = _temp_path(text_path)
+        temp_path.write_bytes(b"".join(encoded))
+        temp_path.replace(text_path)
+    return PostTextStore(text_path, offsets_path, post_ids_path)
+
+
+def load_lemma_ids():
+    # Lemmas of post i are vocab[ids[indptr[i] : indptr[i + 1]]]
+    import numpy as np
+
+    with np.load(derivatives_dir / "lemmas_ids.npz") as data:
+        return {key: data[key] for key in ["post_ids", "vocab", "indptr", "ids"]}
+
+
+def load_doc_term_matrix():
+    # Sparse post x lemma counts, with the post_ids of its rows and vocab of its columns
+    import numpy as np
+    from scipy import sparse
+
+    with np.load(derivatives_dir / "docterm.npz") as data:
+        shape = tuple(data["shape"])
+        counts = sparse.csr_matrix((data["data"], data["indices"], data["indptr"]), shape=shape)
+        return {"counts": counts, "vocab": data["vocab"], "post_ids": data["post_ids"]}
+
+
+# Token attributes filtered on (or looked up) when lemmatizing posts
+LEMMA_FILTER_ATTRS = ["IS_ALPHA", "LENGTH", "LIKE_EMAIL", "LIKE_URL", "LIKE_NUM", "IS_STOP", "POS"]
+
+
+def filter_lemmas(doc, pos_remove_list=None):
+    # Lowercase lemmas of alphabetic, in-vocabulary content words, filtered as attribute masks
+    import numpy as np
+    from spacy.parts_of_speech import IDS
+
+    if pos_remove_list is None:
+        pos_remove_list = ["PROPN", "SMY"]
+    attrs = doc.to_array([*LEMMA_FILTER_ATTRS, "ORTH", "LEMMA"])
+    is_alpha, length, like_email, like_url, like_num, is_stop, pos, orth, lemma = attrs.T
+    keep = (is_alpha == 1) & (length >= 3) & (like_email == 0) & (like_url == 0)
+    keep &= (like_num == 0) & (is_stop == 0)
+    keep &= ~np.isin(pos, [IDS[p] for p in pos_remove_list if p in IDS])
+    # Token.is_oov checks the vectors table rather than a lexeme flag
+    keep[keep] = doc.vocab.vectors.find(keys=orth[keep].tolist()) >= 0
+    lemma_hashes, inverse = np.unique(lemma[keep], return_inverse=True)
+    lemma_strings = [doc.vocab.strings[h].lower() for h in lemma_hashes.tolist()]
+    lemma_strings = np.array(lemma_strings, dtype=object)
+    return lemma_strings[inverse].tolist()
+
+
 def export_table(dataframe, filestem, **kwargs):
     default_kwargs = {
         "sep": "\t",
@@ -153,24 +484,121 @@ def export_table(dataframe, filestem, **kwargs):
     else:
         raise ValueError("Unsupported separator")
     export_path = (tables_dir / filestem).with_suffix(suffix)
-    dataframe.to_csv(export_path, **kwargs)
+    encoding = kwargs.pop("encoding")
+    updated = _write_if_changed(export_path, dataframe.to_csv(**kwargs).encode(encoding))
+    _export_records.append((export_path.name, None, updated))
     return
 
 
-def export_fig(fig, filestem, close=True, **kwargs):
+_export_pool = None
+_export_futures = []  # (filename, future) pairs of background figure exports
+_export_records = []  # (filename, seconds or None, updated) of finished exports
+
+
+def _write_if_changed(export_path, content):
+    # Skip writing identical content, so unchanged outputs keep their modification time
+    if export_path.exists():
+        old_digest = hashlib.sha256(export_path.read_bytes()).digest()
+        if old_digest == hashlib.sha256(content).digest():
+            return False
+    export_path.write_bytes(content)
+    return True
+
+
+def _save_fig(fig, export_path, **kwargs):
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=export_path.suffix.lstrip("."), **kwargs)
+    updated = _write_if_changed(export_path, buffer.getvalue())
+    return time.perf_counter() - start, updated
+
+
+def _save_pickled_fig(fig_pickle, rc, export_path, kwargs):
+    import matplotlib.pyplot as plt
+
+    # Some settings (e.g., mathtext fonts) are only looked up when drawing
+    with plt.rc_context(rc):
+        fig = pickle.loads(fig_pickle)
+        seconds, updated = _save_fig(fig, export_path, **kwargs)
+    plt.close(fig)
+    return seconds, updated
+
+
+def _get_export_pool():
+    import concurrent.futures
+    import multiprocessing
+
+    global _export_pool
+    if _export_pool is None:
+        # Workers are forked, since spawned workers would rerun the calling script
+        mp_context = multiprocessing.get_context("fork")
+        _export_pool = concurrent.futures.ProcessPoolExecutor(mp_context=mp_context)
+    return _export_pool
+
+
+def wait_for_exports():
+    # Registered to run at exit, where a failed export ends the script with an error code
+    global _export_pool
+    errors = []
+    for filename, future in _export_futures:
+        try:
+            _export_records.append((filename, *future.result()))
+        except Exception as error:
+            errors.append(f"Exporting {filename} failed: {error!r}")
+    _export_futures.clear()
+    if _export_pool is not None:
+        _export_pool.shutdown()
+        _export_pool = None
+    if _export_records:
+        n_updated = sum(updated for _, _, updated in _export_records)
+        n_unchanged = len(_export_records) - n_updated
+        print(f"Exported files ({n_updated} updated, {n_unchanged} unchanged, slowest first):")
+        for filename, seconds, updated in sorted(_export_records, key=lambda x: -(x[1] or 0)):
+            seconds_txt = "" if seconds is None else f"{seconds:.2f} s"
+            status = "updated" if updated else "unchanged"
+            print(f"  {seconds_txt:>9}  {status:<9}  {filename}")
+        _export_records.clear()
+    if errors:
+        print("\n".join(errors), file=sys.stderr)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(1)  # Raising here wouldn't change the exit code of the script
+
+
+atexit.register(wait_for_exports)
+
+
+def export_fig(fig, filestem, close=True, background=None, **kwargs):
+    import multiprocessing
+
     assert "format" not in kwargs, "format should not be specified in kwargs"
     default_kwargs = {"dpi": 600, "metadata": dict(CreationDate=None)}
     kwargs = {**default_kwargs, **kwargs}
     formats = ["png", "pdf"]
+    if background is None:
+        background = BACKGROUND_EXPORT and "fork" in multiprocessing.get_all_start_methods()
+    if background:
+        # Each format is rendered concurrently from a pickled copy of the figure
+        from matplotlib import rcParams
+
+        fig_pickle = pickle.dumps(fig)
+        rc = {k: v for k, v in rcParams.items() if not k.startswith("backend")}
+        pool = _get_export_pool()
     for fmt in formats:
         export_path = (figures_dir / filestem).with_suffix(f".{fmt}")
-        fig.savefig(export_path, **kwargs)
+        if background:
+            future = pool.submit(_save_pickled_fig, fig_pickle, rc, export_path, kwargs)
+            _export_futures.append((export_path.name, future))
+        else:
+            _export_records.append((export_path.name, *_save_fig(fig, export_path, **kwargs)))
     if close:
         fig.clf()
     return
 
 
 def load_matplotlib_settings():
+    from matplotlib import rcParams
+
     rcParams["font.family"] = "Times New Roman"
     rcParams["mathtext.fontset"] = "custom"
     rcParams["mathtext.rm"] = "Times New Roman"
@@ -187,6 +615,13 @@ def load_matplotlib_settings():
     rcParams["legend.title_fontsize"] = 8
 
 
+def best_time(function, repeat=5):
+    # Best time (in seconds) of calling function, for benchmarking development changes
+    import timeit
+
+    return min(timeit.repeat(function, repeat=repeat, number=1))
+
+
 def no_leading_zeros(x, pos):
     # a custom tick formatter for matplotlib to show decimals without a leading zero
     val_str = "{:g}".format(x)
@@ -32,7 +32,7 @@ c.load_matplotlib_settings()
 EXPORT_STEM = "describe-categorycounts"
 
 # Load data
-df = c.load_dreamviews_posts()
+df = c.load_dreamviews_posts(columns=["post_id", "user_id", "lucidity", "nightmare"])
 df = df.set_index("post_id")
 
 # Make new columns that denote lucid/non-lucid, independent of overlap ..
@@ -31,13 +31,13 @@ c.load_matplotlib_settings()
 EXPORT_STEM = "describe-categorypairs"
 
 # Load data
-df = c.load_dreamviews_posts()
+df = c.load_dreamviews_posts(columns=["user_id", "lucidity"])
 
 # Generate a dataframe that has lucid and non-lucid post counts per user (for those with >= 1)
 SORT_ORDER = ["nonlucid", "lucid"]
 df_user = (
     df[df["lucidity"].str.contains("lucid")]
-    .groupby(["user_id", "lucidity"])
+    .groupby(["user_id", "lucidity"], observed=True)
     .size()
     .rename("count")
     .unstack(fill_value=0)
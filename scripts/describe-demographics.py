@@ -62,11 +62,11 @@ assert df["gender"].dropna().isin(GENDER_ORDER[:-1]).all(), (
     f"Expected gender values to be in {GENDER_ORDER[:-1]}."
 )
 df["gender"] = pd.Categorical(
-    df["gender"].fillna(UNREPORTED_LABEL), categories=GENDER_ORDER, ordered=True
+    df["gender"].astype(object).fillna(UNREPORTED_LABEL), categories=GENDER_ORDER, ordered=True
 )
 
 # Replace age NAs and make ordered categorical for plotting purposes
-df["age"] = pd.Categorical(df["age"].fillna(UNREPORTED_LABEL), ordered=True)
+df["age"] = pd.Categorical(df["age"].astype(object).fillna(UNREPORTED_LABEL), ordered=True)
 
 # Export
 df_out = df.groupby(["gender", "age"]).size().rename("count")
@@ -74,7 +74,12 @@ c.export_table(df_out, EXPORT_STEM_AGEGENDER)
 
 # Get location frequencies
 country_counts = (
-    df["country"].fillna(UNREPORTED_LABEL).value_counts().rename("n_users").rename_axis("ISO_A3")
+    df["country"]
+    .astype(object)
+    .fillna(UNREPORTED_LABEL)
+    .value_counts()
+    .rename("n_users")
+    .rename_axis("ISO_A3")
 )
 
 # Export (before dropping the unreported and converting to log values)
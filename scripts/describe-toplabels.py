@@ -18,7 +18,7 @@ N_MIN_LABELS = 10  # Only keep labels that show up >= <x> times ..
 N_MIN_USERS = 10  # ... and across >= <y> unique users
 
 # Load data
-df = c.load_dreamviews_posts()
+df = c.load_dreamviews_posts(columns=["user_id", "tags", "categories"])
 
 for col in ["tags", "categories"]:
     # Tag and category columns are strings with double colons separating labels
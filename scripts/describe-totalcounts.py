@@ -50,7 +50,7 @@ if RESTRICT:
     EXPORT_STEM += "_RESTRICT"
 
 # Load data
-df = c.load_dreamviews_posts()
+df = c.load_dreamviews_posts(columns=["user_id", "timestamp", "lucidity"])
 
 # Drop data if desired
 if RESTRICT:
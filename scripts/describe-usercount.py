@@ -25,7 +25,7 @@ c.load_matplotlib_settings()
 EXPORT_STEM = "describe-usercount"
 
 # Load data
-df = c.load_dreamviews_posts()
+df = c.load_dreamviews_posts(columns=["user_id"])
 counts = df["user_id"].value_counts().rename_axis("user_id").rename("n_posts")
 
 ########################################################################################
@@ -34,7 +34,7 @@ export_stem_plots = [
 ]
 
 # Load data
-df = c.load_dreamviews_posts(lemmas=True)
+df = c.load_dreamviews_posts(lemmas=True, columns=["post_id", "user_id", "lucidity", "wordcount"])
 
 ########################################################################################
 # GET FREQUENCIES
@@ -54,7 +54,7 @@ token_melt["token_type"] = token_melt["token_type"].str.rstrip("count")
 
 # Get table of descriptives across the whole corpus that averages within users to account for bias
 total_descr = (
-    token_melt.groupby(["user_id", "token_type"])["n"]
+    token_melt.groupby(["user_id", "token_type"], observed=True)["n"]
     .mean()
     .groupby("token_type")
     .describe()
@@ -63,9 +63,9 @@ total_descr = (
 
 # Same thing but for lucid and non-lucid labeled posts
 lucid_descr = (
-    token_melt.groupby(["user_id", "lucidity", "token_type"])["n"]
+    token_melt.groupby(["user_id", "lucidity", "token_type"], observed=True)["n"]
     .mean()
-    .groupby(["lucidity", "token_type"])
+    .groupby(["lucidity", "token_type"], observed=True)
     .describe()
     .rename_axis("metric", axis=1)
 )
@@ -113,7 +113,9 @@ for i, export_stem_fig in enumerate(export_stem_plots):
         ymax = 0.003
         ylabel = "density"
         for lucidity, series in (
-            df.groupby(["user_id", "lucidity"]).wordcount.mean().groupby("lucidity")
+            df.groupby(["user_id", "lucidity"], observed=True)
+            .wordcount.mean()
+            .groupby("lucidity", observed=True)
         ):
             distvals = series.values
             if "lucid" in lucidity:
@@ -155,7 +157,7 @@ for i, export_stem_fig in enumerate(export_stem_plots):
             ser = df.wordcount
             ymax = 10000
         else:
-            ser = df.groupby("user_id").wordcount.mean()
+            ser = df.groupby("user_id", observed=True).wordcount.mean()
             ymax = 1000
         distvals = ser.values
         ax.hist(distvals, edgecolor=linecolor, linewidth=linewidth, **bar_kwargs)
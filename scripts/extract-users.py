@@ -4,6 +4,7 @@ Clean/reduce the raw user file.
 There is a lot of likely useless user info that won't be in the final output file.
 """
 
+import importlib.metadata
 import json
 import re
 import zipfile
@@ -19,6 +20,7 @@ import config as c
 import_path_html = c.fetch_source_file("dreamviews-users.zip", version="v1")
 import_path_posts = c.fetch_raw_file("dreamviews-posts.tsv", version="v1")
 import_path_userkey = c.derivatives_dir / "dreamviews-users.json"
+country_codes_path = c.derivatives_dir / "dreamviews-countries.json"
 export_path = c.raw_dir / "dreamviews-users.tsv"
 
 # Select which columns will be included in the output file
@@ -97,32 +99,31 @@ COUNTRY_REPLACEMENTS = {
     "Iran": "Iran, Islamic Republic of",
     "Turkey": "Türkiye",
 }
+PYCOUNTRY_VERSION = importlib.metadata.version("pycountry")
 
-# Load extracted posts data to get the list of users who survived filtering
-df = c.load_dreamviews_posts()
-surviving_user_ids = df["user_id"].unique()
+# Load extracted posts data to get the set of users who survived filtering
+df = c.load_dreamviews_posts(columns=["user_id"])
+surviving_user_ids = set(df["user_id"].unique())
 
 # Load in key to get unique anonymous user IDs from the raw IDs
 with open(import_path_userkey, "rt", encoding="utf-8") as f:
     user_mapping = json.load(f)
 
+# Reduce the key to surviving users only, so the loop below scales with surviving users
+# rather than with every profile that was ever scraped. Users without a user mapping
+# can't be surviving users, since the mapping was generated from the posts sourcedata.
+surviving_usernames = {
+    username: user_id for username, user_id in user_mapping.items() if user_id in surviving_user_ids
+}
+
 data = {}
-# Loop over all the raw html files and get user info from each
+# Loop over the raw html files of surviving users only (listing names decompresses nothing).
+# Files are kept in archive order, which the stable sort by join date below keeps for ties.
+# Users without a scraped profile get empty rows below.
 with zipfile.ZipFile(import_path_html, mode="r") as zf:
-    filenames = zf.namelist()
+    filenames = [fn for fn in zf.namelist() if fn[:-5] in surviving_usernames]
     for fn in tqdm(filenames, desc="Extracting users"):
-        # get the original username (raw ID)
-        username = fn[:-5]  # remove ".html" off the end
-        if username not in user_mapping:
-            # Skip users who aren't in the user mapping, which means they are also not
-            # in the posts sourcedata. This shouldn't really happen, and only happens
-            # once because of some weirdness in the data collection process.
-            # The sourcedata users file was created with a few merges of prior scrapes.
-            continue
-        # get the anonymized username (user ID)
-        user_id = user_mapping[username]
-        if user_id not in surviving_user_ids:
-            continue  # skip users whose posts didn't survive filtering
+        user_id = surviving_usernames[fn[:-5]]  # remove ".html" off the end of the username
         html = zf.read(fn)  # read in the html file
         soup = BeautifulSoup(html, "html.parser", from_encoding="windows-1252")
         ## All good info is within <dt> tags. But not all users have all <dt> tags,
@@ -159,9 +160,7 @@ df = df.sort_values(["join_date", "last_activity"])
 # Get country codes
 def get_country_code(x):
     # Make minor adjustments before looking up in pycountry
-    if pd.isna(x):
-        return pd.NA
-    elif x in COUNTRY_REPLACEMENTS:
+    if x in COUNTRY_REPLACEMENTS:
         x = COUNTRY_REPLACEMENTS[x]
     else:
         # Add spaces to multiword countries
@@ -178,7 +177,39 @@ def get_country_code(x):
     return country.alpha_3
 
 
-df["country"] = df["country_flag"].apply(get_country_code)
+def load_country_codes(filepath):
+    """Return the cached mapping of raw country flags to alpha-3 codes.
+
+    The cache is discarded if it was built with different country replacements
+    or another version of pycountry (which renames countries now and then).
+    """
+    if filepath.exists():
+        with open(filepath, "rt", encoding="utf-8") as f:
+            cache = json.load(f)
+        if (
+            cache["replacements"] == COUNTRY_REPLACEMENTS
+            and cache.get("pycountry") == PYCOUNTRY_VERSION
+        ):
+            return cache["codes"]
+    return {}
+
+
+# Resolve each distinct country flag only once, since the pycountry (fuzzy) search is slow.
+# Previously resolved flags are cached on disk and new flags are added to the cache.
+country_codes = load_country_codes(country_codes_path)
+unresolved_flags = set(df["country_flag"].dropna().unique()) - set(country_codes)
+if unresolved_flags:
+    for flag in sorted(unresolved_flags):
+        country_codes[flag] = get_country_code(flag)
+    with open(country_codes_path, "wt", encoding="utf-8") as f:
+        cache = {
+            "replacements": COUNTRY_REPLACEMENTS,
+            "pycountry": PYCOUNTRY_VERSION,
+            "codes": country_codes,
+        }
+        json.dump(cache, f, indent=4, sort_keys=True, ensure_ascii=False)
+
+df["country"] = df["country_flag"].map(country_codes)
 df["gender"] = df["gender"].str.lower()
 df["age"] = df["age"].astype("Int64")
 
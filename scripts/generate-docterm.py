@@ -0,0 +1,38 @@
+"""
+Export the post x lemma count matrix (document-term matrix) of the lemmatized posts,
+so the classifier and wordshift steps can select posts and lemmas from it
+instead of tokenizing the lemmas again (see c.load_doc_term_matrix).
+
+IMPORTS
+=======
+    - lemma ids of each post, lemmas_ids.npz
+EXPORTS
+=======
+    - sparse counts with their vocabulary and post_ids, docterm.npz
+"""
+
+import numpy as np
+from scipy import sparse
+
+import config as c
+
+EXPORT_STEM = "docterm"
+export_path = c.derivatives_dir / f"{EXPORT_STEM}.npz"
+
+lemma_ids = c.load_lemma_ids()
+
+# Each post's lemma ids are already a CSR row, so count them by summing duplicate entries
+shape = (len(lemma_ids["post_ids"]), len(lemma_ids["vocab"]))
+ones = np.ones(len(lemma_ids["ids"]), dtype=np.int64)
+counts = sparse.csr_matrix((ones, lemma_ids["ids"], lemma_ids["indptr"]), shape=shape)
+counts.sum_duplicates()
+
+np.savez(
+    export_path,
+    data=counts.data,
+    indices=counts.indices,
+    indptr=counts.indptr,
+    shape=counts.shape,
+    vocab=lemma_ids["vocab"],
+    post_ids=lemma_ids["post_ids"],
+)
@@ -1,58 +1,248 @@
 """
 Export a 2-column tsv of post_id and lemmatized post text
 for subsequent descriptive (wordcount) and validation steps (classifier and wordshift).
+The same lemmas are also exported as integer ids into a vocabulary (see c.load_lemma_ids).
+
+To split lemmatization across machines, run each of N shards with ``--shard i/N``
+(for i in 0 to N-1), which each lemmatize a slice of the posts selected by hashing post_ids.
+Then run with ``--merge N`` to check that the shards cover every post exactly once
+and combine them into the same exports as a single run.
 """
 
+import argparse
+import csv
+import hashlib
+import importlib.metadata
+import inspect
+import json
+import os
 import random
+import sys
 
+import numpy as np
 import spacy
 from tqdm import tqdm
 
 import config as c
 
-random.seed(91)
 
-EXPORT_STEM = "lemmas"
-export_path = c.derivatives_dir / f"{EXPORT_STEM}.tsv"
+def shard_arg(value):
+    """Parse a shard i/N into (i, N), with i from 0 to N-1."""
+    shard, sep, n_shards = value.partition("/")
+    if not (sep and shard.isdigit() and n_shards.isdigit() and int(shard) < int(n_shards)):
+        raise argparse.ArgumentTypeError(f"expected i/N with i from 0 to N-1, got {value!r}")
+    return int(shard), int(n_shards)
 
-df = c.load_dreamviews_posts()
 
-posts = df.set_index("post_id")["post_text"]
+def positive_int(value):
+    if not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got {value!r}")
+    return int(value)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--batch-size", type=int, default=256, help="Number of posts per spaCy batch.")
+parser.add_argument(
+    "--n-process", type=int, default=1, help="Number of processes lemmatizing batches."
+)
+parser.add_argument("--shuffle", action="store_true", help="Shuffle the lemmas of each post.")
+shard_group = parser.add_mutually_exclusive_group()
+shard_group.add_argument(
+    "--shard", type=shard_arg, help="Only lemmatize shard i/N (e.g., 0/4) of the posts."
+)
+shard_group.add_argument(
+    "--merge", type=positive_int, metavar="N", help="Merge N shards into the exports."
+)
+args = parser.parse_args()
+
+# Each post is shuffled with its own generator, seeded from this seed and its post_id,
+# so shuffling doesn't depend on which other posts are processed or in which order
+SHUFFLE_SEED = 91
+SHUFFLE_SCHEME = {
+    "scheme": "per-post",
+    "seed": SHUFFLE_SEED,
+    "rng": "random.Random(f'{seed}-{post_id}')",
+}
+
+# Lemmas of previously lemmatized post texts are cached, so only new or changed posts are parsed.
+# Once this share of cached texts is no longer in the corpus, the cache is rewritten without them.
+CACHE_COMPACT_FRACTION = 0.2
+POS_REMOVE_LIST = ["PROPN", "SMY"]
 
-# Load spaCy model (used for named entity recognition)
 # # Speed up spaCy by disabling some unncessary stuff
 # SPACY_PIPE_DISABLES = ["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer"]
 SPACY_PIPE_DISABLES = []
-nlp = spacy.load(c.SPACY_MODEL, disable=SPACY_PIPE_DISABLES)
-nlp.add_pipe("merge_entities")  # So "John Paul" gets treated as a single entity
-
-
-def lemmatize(x, shuffle=False, pos_remove_list=None):
-    """Convert a spaCy doc to space-separate string of shuffled lemmas."""
-    doc = nlp(x)
-    if pos_remove_list is None:
-        pos_remove_list = ["PROPN", "SMY"]
-    token_list = []
-    for token in doc:
-        if (
-            (token.is_alpha)
-            and (len(token) >= 3)
-            and (not token.like_email)
-            and (not token.like_url)
-            and (not token.like_num)
-            and (not token.is_stop)
-            and (not token.is_oov)
-            and (token.pos_ not in pos_remove_list)
-        ):
-            token_list.append(token.lemma_.lower())
+SPACY_PIPE_ADDITIONS = ["merge_entities"]  # So "John Paul" gets treated as a single entity
+
+EXPORT_STEM = "lemmas"
+export_path = c.derivatives_dir / f"{EXPORT_STEM}.tsv"
+export_path_shuffle = c.derivatives_dir / f"{EXPORT_STEM}_shuffle.json"
+export_path_ids = c.derivatives_dir / f"{EXPORT_STEM}_ids.npz"
+shards_dir = c.derivatives_dir / f"{EXPORT_STEM}_shards"
+
+df = c.load_dreamviews_posts(columns=["post_id", "post_text"])
+
+posts = df.set_index("post_id")["post_text"]
+
+
+def get_shard(post_id, n_shards):
+    """Return the shard of a post, from a hash of its post_id (the same on any machine)."""
+    return int(hashlib.md5(post_id.encode("utf-8")).hexdigest(), 16) % n_shards
+
+
+def get_shard_path(shard, n_shards):
+    return shards_dir / f"{EXPORT_STEM}_shard-{shard}-of-{n_shards}.tsv"
+
+
+def lemmatize_posts(posts, shard=None):
+    """Return the unshuffled lemmas of each post (space-separated, possibly empty)."""
+    # Cached lemmas are only valid for the same model, pipeline, and token filter.
+    # The model version is read from its package metadata, so cache hits don't load the model.
+    cache_settings = {
+        "model": c.SPACY_MODEL,
+        "model_version": importlib.metadata.version(c.SPACY_MODEL),
+        "spacy_version": spacy.__version__,
+        "pipe_disables": SPACY_PIPE_DISABLES,
+        "pipe_additions": SPACY_PIPE_ADDITIONS,
+        "pos_remove_list": POS_REMOVE_LIST,
+        "filter_source": inspect.getsource(c.filter_lemmas),
+    }
+    cache_key = hashlib.md5(json.dumps(cache_settings, sort_keys=True).encode("utf-8")).hexdigest()
+    # Each shard appends to its own cache file, since appends of concurrent shards could interleave
+    cache_stem = f"lemma-cache_{cache_key}"
+    cache_name = f"{cache_stem}.tsv" if shard is None else f"{cache_stem}_shard-{shard}.tsv"
+    cache_path = c.cache_dir / cache_name
+    for stale_path in c.cache_dir.glob("lemma-cache_*.tsv"):
+        if not stale_path.name.startswith(cache_stem):
+            stale_path.unlink(missing_ok=True)
+
+    # Unshuffled lemmas (space-separated, possibly empty) by md5 of the post text
+    cached_lemmas = {}
+    cache_paths = sorted(c.cache_dir.glob(f"{cache_stem}*.tsv"))
+    for path in cache_paths:
+        *lines, partial_line = path.read_text(encoding="utf-8").split("\n")
+        # Only this run's own file is truncated, since other shards may still be writing theirs
+        if partial_line and path == cache_path:  # Written by an interrupted run
+            os.truncate(path, path.stat().st_size - len(partial_line.encode("utf-8")))
+        for line in lines:
+            text_md5, _, post_lemmas = line.partition("\t")
+            if len(text_md5) == 32 and "\t" not in post_lemmas:  # Skip malformed lines
+                cached_lemmas[text_md5] = post_lemmas
+
+    text_md5s = [hashlib.md5(text.encode("utf-8")).hexdigest() for text in posts]
+    n_hits = sum(text_md5 in cached_lemmas for text_md5 in text_md5s)
+    misses = {}  # Only parse each distinct uncached text once
+    for text_md5, text in zip(text_md5s, posts, strict=True):
+        if text_md5 not in cached_lemmas:
+            misses.setdefault(text_md5, text)
+    n_misses = len(text_md5s) - n_hits
+    print(f"Lemma cache: {n_hits} hits, {n_misses} misses ({len(misses)} distinct texts)")
+
+    # Only load the spaCy model (used for named entity recognition) if some texts aren't cached
+    if misses:
+        nlp = spacy.load(c.SPACY_MODEL, disable=SPACY_PIPE_DISABLES)
+        for pipe_name in SPACY_PIPE_ADDITIONS:
+            nlp.add_pipe(pipe_name)
+        # Docs are yielded in the order of the texts, even when batches are processed in
+        # parallel, and are cached as they come, so an interrupted run keeps its progress
+        docs = nlp.pipe(misses.values(), batch_size=args.batch_size, n_process=args.n_process)
+        with open(cache_path, "at", encoding="utf-8") as f:
+            for text_md5, doc in zip(tqdm(misses, desc="Lemmatizing posts"), docs, strict=True):
+                cached_lemmas[text_md5] = " ".join(c.filter_lemmas(doc, POS_REMOVE_LIST))
+                f.write(f"{text_md5}\t{cached_lemmas[text_md5]}\n")
+
+    # Compact the cache by rewriting it with only the current texts (via a temporary file),
+    # which also folds in the shards' cache files. Shards don't compact, since texts of
+    # other shards aren't stale.
+    n_stale = len(cached_lemmas) - len(set(text_md5s))
+    if shard is None and n_stale > CACHE_COMPACT_FRACTION * len(cached_lemmas):
+        temp_path = c._temp_path(cache_path)
+        with open(temp_path, "wt", encoding="utf-8") as f:
+            for text_md5 in dict.fromkeys(text_md5s):
+                f.write(f"{text_md5}\t{cached_lemmas[text_md5]}\n")
+        temp_path.replace(cache_path)
+        for path in cache_paths:
+            if path != cache_path:
+                path.unlink(missing_ok=True)
+        print(f"Lemma cache: compacted, removing {n_stale} texts no longer in the corpus")
+    return [cached_lemmas[text_md5] for text_md5 in text_md5s]
+
+
+def lemmatize(post_lemmas, post_id=None, shuffle=False):
+    """Return space-separated (and optionally shuffled) lemmas, or None if there are none."""
+    token_list = post_lemmas.split()
     if shuffle:
-        token_list = random.sample(token_list, len(token_list))
+        rng = random.Random(f"{SHUFFLE_SEED}-{post_id}")
+        token_list = rng.sample(token_list, len(token_list))
     if token_list:
         return " ".join(token_list)
     return
 
 
-tqdm.pandas(desc="Lemmatizing posts")
-lemmas = posts.progress_apply(lemmatize).dropna().to_frame(name="post_lemmas")
+if args.merge is not None:
+    # Read the shards, checking that they cover each post exactly once
+    unshuffled_lemmas = {}
+    for shard in range(args.merge):
+        with open(get_shard_path(shard, args.merge), "rt", encoding="ascii", newline="") as f:
+            reader = csv.reader(f, delimiter="\t")
+            next(reader)  # Header
+            for post_id, post_lemmas in reader:
+                if post_id in unshuffled_lemmas:
+                    raise ValueError(f"Post {post_id} is in more than one shard")
+                unshuffled_lemmas[post_id] = post_lemmas
+    missing = posts.index.difference(list(unshuffled_lemmas))
+    extra = set(unshuffled_lemmas).difference(posts.index)
+    if len(missing) or extra:
+        raise ValueError(f"Shards are missing {len(missing)} posts and have {len(extra)} others")
+    unshuffled_lemmas = [unshuffled_lemmas[post_id] for post_id in posts.index]
+elif args.shard is not None:
+    # Lemmatize one shard, and export its (unshuffled) lemmas for merging
+    shard, n_shards = args.shard
+    in_shard = [get_shard(post_id, n_shards) == shard for post_id in posts.index]
+    posts = posts[in_shard]
+    unshuffled_lemmas = lemmatize_posts(posts, shard=f"{shard}-of-{n_shards}")
+    shards_dir.mkdir(exist_ok=True)
+    with open(get_shard_path(shard, n_shards), "wt", encoding="ascii", newline="") as f:
+        writer = csv.writer(f, delimiter="\t", lineterminator=os.linesep)
+        writer.writerow(["post_id", "post_lemmas"])
+        writer.writerows(zip(posts.index, unshuffled_lemmas, strict=True))
+    sys.exit()
+else:
+    unshuffled_lemmas = lemmatize_posts(posts)
+
+# Lemmas are written in the same format pandas would write them (in the order of the posts)
+lemma_lists = {}
+with open(export_path, "wt", encoding="ascii", newline="") as f:
+    writer = csv.writer(f, delimiter="\t", lineterminator=os.linesep)
+    writer.writerow(["post_id", "post_lemmas"])
+    for post_id, post_lemmas in zip(posts.index, unshuffled_lemmas, strict=True):
+        post_lemmas = lemmatize(post_lemmas, post_id, shuffle=args.shuffle)
+        if post_lemmas is not None:
+            writer.writerow([post_id, post_lemmas])
+            lemma_lists[post_id] = post_lemmas.split()
+
+# Export the same lemmas as ids into a sorted vocabulary, with each post's ids
+# stored in one array and delimited by indptr (like the rows of a CSR matrix)
+vocab = sorted({lemma for lemma_list in lemma_lists.values() for lemma in lemma_list})
+vocab_ids = {lemma: i for i, lemma in enumerate(vocab)}
+indptr = np.zeros(len(lemma_lists) + 1, dtype=np.int64)
+np.cumsum([len(lemma_list) for lemma_list in lemma_lists.values()], out=indptr[1:])
+ids = np.fromiter(
+    (vocab_ids[lemma] for lemma_list in lemma_lists.values() for lemma in lemma_list),
+    dtype=np.int32,
+    count=indptr[-1],
+)
+np.savez(
+    export_path_ids,
+    post_ids=np.array(list(lemma_lists), dtype=str),
+    vocab=np.array(vocab, dtype=str),
+    indptr=indptr,
+    ids=ids,
+)
 
-lemmas.to_csv(export_path, sep="\t", encoding="ascii")
+# Record how the lemmas were shuffled, next to the lemmas
+if args.shuffle:
+    with open(export_path_shuffle, "wt", encoding="utf-8") as f:
+        json.dump(SHUFFLE_SCHEME, f, indent=4)
+else:
+    export_path_shuffle.unlink(missing_ok=True)
@@ -0,0 +1,683 @@
+"""
+Declare the analysis pipeline as a graph of steps and run it.
+
+Each step is a single run of a script, with the files it reads (inputs) and writes (outputs)
+as paths relative to the output directory. A step depends on every other selected step that
+outputs one of its inputs. Inputs without a selected step producing them (e.g., raw files
+fetched from Zenodo) are assumed to exist. Steps without dependencies between them can run
+concurrently.
+
+Steps only rerun when something they depend on changed since their last successful run,
+like make but with content hashes instead of modification times. That includes the script
+source, its arguments, the source of the config functions it uses (and of those they use),
+the config constants used by either, the content of its inputs, and the content of its
+outputs (which also reruns steps whose outputs were deleted or modified).
+Hashes are recorded in a manifest file in the cache directory.
+
+Steps run as separate Python processes by default. In warm mode, the runner imports
+the heavy dependencies and loads the corpus once, and forks each step from itself instead,
+so steps skip that setup. Forked steps still can't affect each other (e.g., through
+matplotlib settings or modified data frames), since each gets a copy of the runner's state.
+"""
+
+import ast
+import datetime
+import hashlib
+import importlib.metadata
+import importlib.util
+import json
+import os
+import platform
+import re
+import runpy
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from pathlib import Path
+
+import config as c
+
+POSTS = "raw/dreamviews-posts.tsv"
+USERS = "raw/dreamviews-users.tsv"
+USERKEY = "derivatives/dreamviews-users.json"
+LEMMAS = "derivatives/lemmas.tsv"
+LEMMA_IDS = "derivatives/lemmas_ids.npz"
+DOCTERM = "derivatives/docterm.npz"
+LIWC_DIC = "sourcedata/InsightAgency.dic"
+
+# Optional dependencies that are slow to import or install, reported for the steps needing them
+HEAVY_DEPENDENCIES = ["spacy", "sklearn", "gensim", "shifterator", "liwc", "geopandas", "nltk"]
+
+# Config settings that change how steps run but not what they output
+RUNTIME_SETTINGS = ["PARANOID", "BACKGROUND_EXPORT"]
+
+
+def _figures(stem):
+    return [f"figures/{stem}.png", f"figures/{stem}.pdf"]
+
+
+# Steps are declared in the order they run in when run one at a time.
+# Stages select which steps run (describe and validate steps always run).
+STEPS = {
+    "scrape-posts": {
+        "script": "scrape-posts.py",
+        "args": [],
+        "stages": ["scrape"],
+        "inputs": [],
+        "outputs": ["sourcedata/dreamviews-posts.zip"],
+    },
+    "extract-posts": {
+        "script": "extract-posts.py",
+        "args": [],
+        "stages": ["scrape", "extract"],
+        "inputs": ["sourcedata/dreamviews-posts.zip"],
+        "outputs": [POSTS, USERKEY],
+    },
+    "scrape-users": {
+        "script": "scrape-users.py",
+        "args": [],
+        "stages": ["scrape"],
+        "inputs": [USERKEY],
+        "outputs": ["sourcedata/dreamviews-users.zip"],
+    },
+    "extract-users": {
+        "script": "extract-users.py",
+        "args": [],
+        "stages": ["extract"],
+        "inputs": ["sourcedata/dreamviews-users.zip", POSTS, USERKEY],
+        "outputs": [USERS, "derivatives/dreamviews-countries.json"],
+    },
+    "describe-totalcounts": {
+        "script": "describe-totalcounts.py",
+        "args": [],
+        "stages": ["describe"],
+        "inputs": [POSTS],
+        "outputs": ["tables/describe-totalcounts.tsv", *_figures("describe-totalcounts")],
+    },
+    "describe-usercount": {
+        "script": "describe-usercount.py",
+        "args": [],
+        "stages": ["describe"],
+        "inputs": [POSTS],
+        "outputs": _figures("describe-usercount"),
+    },
+    "describe-toplabels": {
+        "script": "describe-toplabels.py",
+        "args": [],
+        "stages": ["describe"],
+        "inputs": [POSTS],
+        "outputs": ["tables/describe-topcategories.tsv", "tables/describe-toptags.tsv"],
+    },
+    "describe-categorycounts": {
+        "script": "describe-categorycounts.py",
+        "args": [],
+        "stages": ["describe"],
+        "inputs": [POSTS],
+        "outputs": _figures("describe-categorycounts"),
+    },
+    "describe-categorypairs": {
+        "script": "describe-categorypairs.py",
+        "args": [],
+        "stages": ["describe"],
+        "inputs": [POSTS],
+        "outputs": ["tables/describe-categorypairs.tsv", *_figures("describe-categorypairs")],
+    },
+    "describe-demographics": {
+        "script": "describe-demographics.py",
+        "args": [],
+        "stages": ["describe"],
+        "inputs": [USERS, "derivatives/ne_110m_admin_0_countries.zip"],
+        "outputs": [
+            "tables/describe-demographics_provided.tsv",
+            "tables/describe-demographics_agegender.tsv",
+            "tables/describe-demographics_location.tsv",
+            *_figures("describe-demographics_agegender"),
+            *_figures("describe-demographics_location"),
+        ],
+    },
+    "generate-lemmas": {
+        "script": "generate-lemmas.py",
+        "args": [],
+        "stages": ["describe"],
+        "inputs": [POSTS],
+        "outputs": [LEMMAS, LEMMA_IDS],
+    },
+    "generate-docterm": {
+        "script": "generate-docterm.py",
+        "args": [],
+        "stages": ["describe"],
+        "inputs": [LEMMA_IDS],
+        "outputs": [DOCTERM],
+    },
+    "describe-wordcount": {
+        "script": "describe-wordcount.py",
+        "args": [],
+        "stages": ["describe"],
+        "inputs": [POSTS, LEMMAS],
+        "outputs": [
+            "tables/describe-wordcount.tsv",
+            *_figures("describe-wordcount_perpost"),
+            *_figures("describe-wordcount_peruser"),
+            *_figures("describe-wordcount_lucidity"),
+        ],
+    },
+    "validate-classifier": {
+        "script": "validate-classifier.py",
+        "args": [],
+        "stages": ["validate"],
+        "inputs": [POSTS, LEMMAS, DOCTERM],
+        "outputs": ["derivatives/validate-classifier.npz"],
+    },
+    "validate-classifier_stats": {
+        "script": "validate-classifier_stats.py",
+        "args": [],
+        "stages": ["validate"],
+        "inputs": ["derivatives/validate-classifier.npz"],
+        "outputs": ["tables/validate-classifier_cv.tsv", "tables/validate-classifier_avg.tsv"],
+    },
+    "validate-liwc": {
+        "script": "validate-liwc.py",
+        "args": ["--words"],
+        "stages": ["validate"],
+        "inputs": [POSTS, LIWC_DIC],
+        "outputs": [
+            "tables/validate-liwc.tsv",
+            "derivatives/validate-liwc_data.npz",
+            "derivatives/validate-liwc_attr.npz",
+        ],
+    },
+    "validate-liwc_stats": {
+        "script": "validate-liwc_stats.py",
+        "args": [],
+        "stages": ["validate"],
+        "inputs": [POSTS, "tables/validate-liwc.tsv"],
+        "outputs": [
+            "tables/validate-liwc_descr.tsv",
+            "tables/validate-liwc_stats.tsv",
+            *_figures("validate-liwc"),
+        ],
+    },
+    "validate-liwc_word_stats": {
+        "script": "validate-liwc_word_stats.py",
+        "args": [],
+        "stages": ["validate"],
+        "inputs": [
+            POSTS,
+            LIWC_DIC,
+            "derivatives/validate-liwc_data.npz",
+            "derivatives/validate-liwc_attr.npz",
+        ],
+        "outputs": ["tables/validate-liwc_words.tsv"],
+    },
+    "validate-liwc_word_plot-insight": {
+        "script": "validate-liwc_word_plot.py",
+        "args": ["--category", "insight"],
+        "stages": ["validate"],
+        "inputs": ["tables/validate-liwc_words.tsv", "tables/validate-liwc_stats.tsv"],
+        "outputs": _figures("validate-liwc_insight"),
+    },
+    "validate-liwc_word_plot-agency": {
+        "script": "validate-liwc_word_plot.py",
+        "args": ["--category", "agency"],
+        "stages": ["validate"],
+        "inputs": ["tables/validate-liwc_words.tsv", "tables/validate-liwc_stats.tsv"],
+        "outputs": _figures("validate-liwc_agency"),
+    },
+    "validate-wordshift": {
+        "script": "validate-wordshift.py",
+        "args": [],
+        "stages": ["validate"],
+        "inputs": [POSTS, LEMMAS],
+        "outputs": [
+            "tables/validate-wordshift_fear.tsv",
+            "tables/validate-wordshift_jsd.tsv",
+            "tables/validate-wordshift_ld1grams.tsv",
+            "tables/validate-wordshift_ld2grams.tsv",
+            "figures/validate-wordshift_src.png",
+            "figures/validate-wordshift_jsd_src.png",
+            "figures/validate-wordshift_fear_src.png",
+        ],
+    },
+    "validate-wordshift_plot-jsd": {
+        "script": "validate-wordshift_plot.py",
+        "args": ["--shift", "jsd"],
+        "stages": ["validate"],
+        "inputs": ["tables/validate-wordshift_jsd.tsv"],
+        "outputs": _figures("validate-wordshift_jsd"),
+    },
+    "validate-wordshift_plot-fear": {
+        "script": "validate-wordshift_plot.py",
+        "args": ["--shift", "fear"],
+        "stages": ["validate"],
+        "inputs": ["tables/validate-wordshift_fear.tsv"],
+        "outputs": _figures("validate-wordshift_fear"),
+    },
+}
+
+
+def select_steps(stages):
+    """Return the steps (in declaration order) that belong to any of the stages."""
+    return {name: step for name, step in STEPS.items() if set(step["stages"]) & set(stages)}
+
+
+def get_dependencies(steps):
+    """Return the names of the steps each step depends on, among the given steps."""
+    producers = {output: name for name, step in steps.items() for output in step["outputs"]}
+    return {
+        name: {producers[i] for i in step["inputs"] if i in producers and producers[i] != name}
+        for name, step in steps.items()
+    }
+
+
+def select_target_steps(steps, targets):
+    """Return the steps (in declaration order) needed to produce the targets.
+
+    Targets are step names or output files, given by path relative to the output directory
+    or by file name. Only the steps upstream of the targets are included.
+    """
+    producers = {output: name for name, step in steps.items() for output in step["outputs"]}
+    needed = set()
+    for target in targets:
+        if target in steps:
+            needed.add(target)
+            continue
+        names = {
+            name for output, name in producers.items() if target in (output, Path(output).name)
+        }
+        if not names:
+            raise ValueError(f"No selected step is named {target} or outputs it")
+        needed |= names
+    dependencies = get_dependencies(steps)
+    unresolved = list(needed)
+    while unresolved:
+        for dependency in dependencies[unresolved.pop()] - needed:
+            needed.add(dependency)
+            unresolved.append(dependency)
+    return {name: step for name, step in steps.items() if name in needed}
+
+
+manifest_path = c.cache_dir / "pipeline-manifest.json"
+# Resource usage of the steps of each run, appended to keep a history across runs
+report_path = c.output_dir / "pipeline-runs.jsonl"
+
+
+def load_manifest():
+    if not manifest_path.exists():
+        return {"steps": {}, "files": {}}
+    with open(manifest_path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest):
+    temp_path = c._temp_path(manifest_path)
+    with open(temp_path, "wt", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    temp_path.replace(manifest_path)
+
+
+def _hash_file(filepath, manifest):
+    # Files are only rehashed when their size, modification time, or inode changed
+    if not filepath.exists():
+        return None
+    signature = c._file_signature(filepath)
+    key = filepath.resolve().as_posix()
+    record = manifest["files"].get(key)
+    if record is None or record["signature"] != signature:
+        record = {"signature": signature, "md5": c._file_md5(filepath)}
+        manifest["files"][key] = record
+    return record["md5"]
+
+
+def _config_constants(script_source):
+    return sorted(set(re.findall(r"\bc\.([A-Z][A-Z0-9_]*)\b", script_source)))
+
+
+def _config_definitions():
+    # Source of each function and class in config.py, and the names used in it
+    config_source = Path(c.__file__).read_text(encoding="utf-8")
+    definitions = {}
+    for node in ast.parse(config_source).body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            names = {child.id for child in ast.walk(node) if isinstance(child, ast.Name)}
+            definitions[node.name] = (ast.get_source_segment(config_source, node), names)
+    return definitions
+
+
+def _config_dependencies(script_source):
+    # Hashes of the config functions a script uses (directly or through other config functions),
+    # and the config constants used by the script or those functions
+    definitions = _config_definitions()
+    names = set(re.findall(r"\bc\.(\w+)\b", script_source))
+    unvisited = list(names)
+    while unvisited:
+        _, used_names = definitions.get(unvisited.pop(), (None, set()))
+        unvisited.extend(used_names - names)
+        names |= used_names
+    functions = {
+        name: hashlib.md5(definitions[name][0].encode("utf-8")).hexdigest()
+        for name in sorted(names)
+        if name in definitions
+    }
+    constants = [
+        name
+        for name in sorted(names)
+        if re.fullmatch(r"[A-Z][A-Z0-9_]*", name)
+        and hasattr(c, name)
+        and name not in RUNTIME_SETTINGS
+    ]
+    return functions, constants
+
+
+def get_requirements(step):
+    """Return the heavy dependencies a step imports, and the spaCy model if it loads one."""
+    script_source = Path(step["script"]).read_text(encoding="utf-8")
+    modules = set()
+    for node in ast.parse(script_source).body:
+        if isinstance(node, ast.Import):
+            modules.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module is not None:
+            modules.add(node.module.split(".")[0])
+    requirements = [module for module in HEAVY_DEPENDENCIES if module in modules]
+    if "SPACY_MODEL" in _config_constants(script_source):
+        requirements.append(c.SPACY_MODEL)
+    return requirements
+
+
+def is_installed(package):
+    """Return whether a package is installed, from its metadata and without importing it."""
+    try:
+        importlib.metadata.distribution(package)
+    except importlib.metadata.PackageNotFoundError:
+        return importlib.util.find_spec(package) is not None  # Import names like sklearn
+    return True
+
+
+def get_step_state(step, manifest):
+    """Return the hashes of everything a step's outputs are derived from."""
+    script_path = Path(step["script"])
+    functions, constants = _config_dependencies(script_path.read_text(encoding="utf-8"))
+    return {
+        "script": _hash_file(script_path, manifest),
+        "args": step["args"],
+        "config_functions": functions,
+        "config": {name: repr(getattr(c, name)) for name in constants},
+        "inputs": {path: _hash_file(c.output_dir / path, manifest) for path in step["inputs"]},
+    }
+
+
+def get_rerun_reasons(name, step, manifest):
+    """Return the reasons a step needs to rerun, which are none if it's up to date."""
+    record = manifest["steps"].get(name)
+    if record is None:
+        return ["no previous run"]
+    state = get_step_state(step, manifest)
+    reasons = []
+    if state["script"] != record["script"]:
+        reasons.append("script changed")
+    if state["args"] != record["args"]:
+        reasons.append("arguments changed")
+    config_functions = record.get("config_functions", {})
+    for function in sorted(set(state["config_functions"]) | set(config_functions)):
+        if state["config_functions"].get(function) != config_functions.get(function):
+            reasons.append(f"config.{function} changed")
+    for constant in sorted(set(state["config"]) | set(record["config"])):
+        if state["config"].get(constant) != record["config"].get(constant):
+            reasons.append(f"config.{constant} changed")
+    for path, md5 in state["inputs"].items():
+        if md5 is None:
+            reasons.append(f"{path} missing")
+        elif md5 != record["inputs"].get(path):
+            reasons.append(f"{path} changed")
+    for path in step["outputs"]:
+        md5 = _hash_file(c.output_dir / path, manifest)
+        if md5 is None:
+            reasons.append(f"{path} missing")
+        elif md5 != record["outputs"].get(path):
+            reasons.append(f"{path} modified")
+    return reasons
+
+
+def plan_steps(steps, force=False):
+    """Return the reasons each step would rerun, without running anything.
+
+    Steps downstream of a rerun step may rerun too, but only if its outputs change.
+    """
+    manifest = load_manifest()
+    dependencies = get_dependencies(steps)
+    plan = {}
+    for name, step in steps.items():
+        if force:
+            plan[name] = ["forced"]
+            continue
+        reasons = get_rerun_reasons(name, step, manifest)
+        reruns = sorted(dep for dep in dependencies[name] if plan.get(dep))
+        reasons += [f"{dep} reruns (if its outputs change)" for dep in reruns]
+        plan[name] = reasons
+    save_manifest(manifest)  # Keeps file hashes, so running the plan doesn't rehash them
+    return plan
+
+
+def warm_up():
+    """Import the heavy dependencies and preload the corpus, for steps forked afterwards."""
+    import matplotlib.pyplot  # noqa: F401
+    import pandas  # noqa: F401
+    import seaborn  # noqa: F401
+
+    c.preload_corpus()
+
+
+def _run_script(script, args, log):
+    """Run a script in this (forked) process and return its exit code."""
+    if log is not None:
+        os.dup2(log.fileno(), sys.stdout.fileno())
+        os.dup2(log.fileno(), sys.stderr.fileno())
+    sys.argv = [script, *args]
+    try:
+        runpy.run_path(script, run_name="__main__")
+        returncode = 0
+    except SystemExit as exit_:
+        if exit_.code is None or isinstance(exit_.code, int):
+            returncode = exit_.code or 0
+        else:
+            print(exit_.code, file=sys.stderr)
+            returncode = 1
+    except BaseException:
+        traceback.print_exc()
+        returncode = 1
+    # Forked processes exit without running atexit handlers
+    c.wait_for_exports()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return returncode
+
+
+class ForkedStep:
+    """A step running in a process forked from the runner, with the Popen attributes used here."""
+
+    def __init__(self, step, log):
+        self.returncode = None
+        self.pid = os.fork()
+        if self.pid == 0:
+            os._exit(_run_script(step["script"], step["args"], log))
+
+    def terminate(self):
+        os.kill(self.pid, signal.SIGTERM)
+
+    def wait(self):
+        if self.returncode is None:
+            _, status = os.waitpid(self.pid, 0)
+            self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+
+def _start_step(step, capture, warm=False):
+    # Output is captured to a file if steps run concurrently, and streamed otherwise
+    log = tempfile.TemporaryFile() if capture else None  # noqa: SIM115
+    if warm:
+        c.preload_corpus()  # Picks up corpus files written by earlier steps
+        sys.stdout.flush()
+        sys.stderr.flush()
+        return ForkedStep(step, log), log, time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, step["script"], *step["args"]],
+        stdout=log,
+        stderr=subprocess.STDOUT if capture else None,
+    )
+    return process, log, time.perf_counter()
+
+
+def _reap_step(process):
+    """Return the resource usage of a step's process if it finished, or None if it's running."""
+    pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+    if pid == 0:
+        return None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return rusage
+
+
+def _package_version(module):
+    distributions = importlib.metadata.packages_distributions().get(module, [module])
+    try:
+        return importlib.metadata.version(distributions[0])
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def _step_report(step, state, seconds, rusage):
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    peak_rss_bytes = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    output_bytes = {}
+    for path in step["outputs"]:
+        filepath = c.output_dir / path
+        output_bytes[path] = filepath.stat().st_size if filepath.exists() else None
+    return {
+        "wall_seconds": round(seconds, 3),
+        "user_seconds": round(rusage.ru_utime, 3),
+        "system_seconds": round(rusage.ru_stime, 3),
+        "peak_rss_mb": round(peak_rss_bytes / 2**20, 1),
+        "output_bytes": output_bytes,
+        "inputs": state["inputs"],
+        "versions": {module: _package_version(module) for module in get_requirements(step)},
+    }
+
+
+def load_report_history():
+    if not report_path.exists():
+        return []
+    with open(report_path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def save_run_report(run):
+    """Append a run to the report history and print it, next to each step's previous run."""
+    history = load_report_history()
+    with open(report_path, "at", encoding="utf-8") as f:
+        f.write(json.dumps(run, sort_keys=True) + "\n")
+    if not run["steps"]:
+        return
+    print(f"Step resource usage (report in {report_path}):")
+    print(f"  {'step':<32} {'wall s':>8} {'user s':>8} {'sys s':>8} {'RSS MB':>8} {'out MB':>8}")
+    for name, report in sorted(run["steps"].items(), key=lambda x: -x[1]["wall_seconds"]):
+        output_mb = sum(filter(None, report["output_bytes"].values())) / 2**20
+        previous = [r["steps"][name] for r in history if name in r["steps"]]
+        previous_txt = ""
+        if previous:
+            previous_txt = (
+                f"  (last run {previous[-1]['wall_seconds']:.1f} s,"
+                f" {previous[-1]['peak_rss_mb']:.0f} MB)"
+            )
+        print(
+            f"  {name:<32} {report['wall_seconds']:>8.1f} {report['user_seconds']:>8.1f}"
+            f" {report['system_seconds']:>8.1f} {report['peak_rss_mb']:>8.0f} {output_mb:>8.1f}"
+            + previous_txt
+        )
+
+
+def _print_log(log):
+    log.seek(0)
+    sys.stdout.write(log.read().decode("utf-8", errors="replace"))
+    sys.stdout.flush()
+    log.close()
+
+
+def run_steps(steps, jobs=1, force=False, warm=False):
+    """Run outdated steps in dependency order with up to ``jobs`` steps running at once.
+
+    With more than one job, each step's output is printed once the step finishes,
+    so logs of concurrent steps don't interleave. The first failing step stops
+    the pipeline (terminating any running steps), and its exit code is returned.
+    Whether a step is outdated is checked right before it would start, once the steps
+    it depends on finished. With ``force``, all steps run. With ``warm``, steps are forked
+    from this process after warming it up (see ``warm_up``) instead of started from scratch.
+    The wall time, CPU time, and peak memory of each step's process (not counting processes
+    it starts itself) and the sizes of its outputs are appended to the run report.
+    """
+    assert jobs >= 1, f"Can't run steps with {jobs} jobs"
+    if warm:
+        warm_up()
+    run = {
+        "started": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "jobs": jobs,
+        "warm": warm,
+        "steps": {},
+    }
+    manifest = load_manifest()
+    dependencies = get_dependencies(steps)
+    pending = list(steps)
+    running = {}
+    finished = set()
+    while pending or running:
+        ready = [name for name in pending if dependencies[name] <= finished]
+        for name in ready:
+            if len(running) >= jobs:
+                break
+            pending.remove(name)
+            reasons = ["forced"] if force else get_rerun_reasons(name, steps[name], manifest)
+            if not reasons:
+                print(f"[{name}] up to date", flush=True)
+                finished.add(name)
+                continue
+            print(f"[{name}] started ({'; '.join(reasons)})", flush=True)
+            state = get_step_state(steps[name], manifest)
+            running[name] = (*_start_step(steps[name], capture=jobs > 1, warm=warm), state)
+        if not running:
+            if ready:
+                continue  # All ready steps were up to date
+            raise RuntimeError(f"Steps have circular dependencies: {', '.join(pending)}")
+        time.sleep(0.05)
+        for name, (process, log, start, state) in list(running.items()):
+            rusage = _reap_step(process)
+            if rusage is None:
+                continue
+            del running[name]
+            if log is not None:
+                _print_log(log)
+            seconds = time.perf_counter() - start
+            run["steps"][name] = _step_report(steps[name], state, seconds, rusage)
+            run["steps"][name]["returncode"] = process.returncode
+            if process.returncode != 0:
+                for other_process, other_log, _, _ in running.values():
+                    other_process.terminate()
+                    other_process.wait()
+                    if other_log is not None:
+                        other_log.close()
+                print(f"[{name}] failed after {seconds:.1f} s", file=sys.stderr, flush=True)
+                manifest["steps"].pop(name, None)
+                save_manifest(manifest)
+                run["returncode"] = process.returncode
+                save_run_report(run)
+                return process.returncode
+            print(f"[{name}] finished in {seconds:.1f} s", flush=True)
+            outputs = steps[name]["outputs"]
+            state["outputs"] = {path: _hash_file(c.output_dir / path, manifest) for path in outputs}
+            manifest["steps"][name] = state
+            save_manifest(manifest)
+            finished.add(name)
+    save_manifest(manifest)  # Keeps hashes of files checked by up-to-date steps
+    run["returncode"] = 0
+    save_run_report(run)
+    return 0
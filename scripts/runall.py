@@ -1,69 +1,92 @@
 """See the README.md for details about each script."""
 
 import argparse
+import os
 import subprocess
 import sys
 
-import spacy
-
+import config as c
+import pipeline
 from config import SPACY_MODEL, manuscript_dir
 
 
-def run(script, *args, **kwargs):
-    result = subprocess.run([sys.executable, script, *args], **kwargs)
-    if result.returncode != 0:
-        sys.exit(result.returncode)
+def positive_int(value):
+    if not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got {value!r}")
+    return int(value)
 
 
 parser = argparse.ArgumentParser(description="Run all steps")
 parser.add_argument("--scrape", action="store_true", help="Scrape data.")
 parser.add_argument("--extract", action="store_true", help="Extract data.")
 parser.add_argument("--compile", action="store_true", help="Compile manuscript.")
+parser.add_argument(
+    "--target",
+    action="append",
+    metavar="OUTPUT_OR_STEP",
+    help="Only run the steps needed for an output file or step (can be repeated).",
+)
+parser.add_argument(
+    "-j", "--jobs", type=positive_int, default=1, help="Number of steps to run concurrently."
+)
+parser.add_argument(
+    "--paranoid", action="store_true", help="Re-hash fetched files, ignoring prior checks."
+)
+parser.add_argument(
+    "--background-export", action="store_true", help="Render figures in background processes."
+)
+parser.add_argument(
+    "--warm",
+    action="store_true",
+    help="Fork steps from one process that preloaded dependencies and the corpus.",
+)
+parser.add_argument(
+    "--dry-run", action="store_true", help="Show which steps would run and why, then exit."
+)
+parser.add_argument("--force", action="store_true", help="Run all steps, even if up to date.")
 args = parser.parse_args()
 
-# Setup
-try:
-    spacy.load(SPACY_MODEL)
-except OSError:
-    subprocess.run([sys.executable, "-m", "spacy", "download", SPACY_MODEL], check=True)
+# Environment variables are inherited by each step's subprocess, while steps forked with --warm
+# share this process's already imported config, so its settings are set there too
+if args.paranoid:
+    os.environ["DREAMVIEWS_PARANOID"] = "1"
+    c.PARANOID = True
+if args.background_export:
+    os.environ["DREAMVIEWS_BACKGROUND_EXPORT"] = "1"
+    c.BACKGROUND_EXPORT = True
 
-# Scrape
+# Select the steps, in dependency order
+stages = ["describe", "validate"]
 if args.scrape:
-    print("Running scraping steps...")
-    run("scrape-posts.py")
-    run("extract-posts.py")
-    run("scrape-users.py")
-
-# Extract
+    stages.append("scrape")
 if args.extract:
-    print("Running extraction steps...")
-    if not args.scrape:
-        run("extract-posts.py")
-    run("extract-users.py")
+    stages.append("extract")
+steps = pipeline.select_steps(stages)
+if args.target:
+    try:
+        steps = pipeline.select_target_steps(steps, args.target)
+    except ValueError as error:
+        parser.error(str(error))
 
-# Describe
-print("Running descriptive steps...")
-run("describe-totalcounts.py")
-run("describe-usercount.py")
-run("describe-toplabels.py")
-run("describe-categorycounts.py")
-run("describe-categorypairs.py")
-run("describe-demographics.py")
-run("generate-lemmas.py")  # Lemmas needed for wordcount, classifier, and wordshift
-run("describe-wordcount.py")
+# Report what will run and why, and which heavy dependencies it needs
+plan = pipeline.plan_steps(steps, force=args.force)
+requirements = {}
+for name, reasons in plan.items():
+    requirements[name] = pipeline.get_requirements(steps[name]) if reasons else []
+    requirements_txt = f" (needs {', '.join(requirements[name])})" if requirements[name] else ""
+    print(f"[{name}] " + ("; ".join(reasons) if reasons else "up to date") + requirements_txt)
+if args.dry_run:
+    sys.exit(0)
+
+# Setup, checking package metadata rather than loading the spaCy model
+needs_spacy_model = any(SPACY_MODEL in reqs for reqs in requirements.values())
+if needs_spacy_model and not pipeline.is_installed(SPACY_MODEL):
+    subprocess.run([sys.executable, "-m", "spacy", "download", SPACY_MODEL], check=True)
 
-# Validate
-print("Running validation steps...")
-run("validate-classifier.py")
-run("validate-classifier_stats.py")
-run("validate-liwc.py", "--words")
-run("validate-liwc_stats.py")
-run("validate-liwc_word_stats.py")
-run("validate-liwc_word_plot.py", "--category", "insight")
-run("validate-liwc_word_plot.py", "--category", "agency")
-run("validate-wordshift.py")
-run("validate-wordshift_plot.py", "--shift", "jsd")
-run("validate-wordshift_plot.py", "--shift", "fear")
+# Run the selected steps that are out of date
+returncode = pipeline.run_steps(steps, jobs=args.jobs, force=args.force, warm=args.warm)
+if returncode != 0:
+    sys.exit(returncode)
 
 # Compile
 print("Running compilation steps...")
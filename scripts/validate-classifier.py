@@ -13,71 +13,153 @@ all this rn.
 IMPORTS
 =======
     - posts, dreamviews-posts.tsv
+    - post x lemma counts, docterm.npz
 EXPORTS
 =======
     - numpy file with predictions and labels, validate-classifier.npz
+    - with --solver linearsvc or sgd, the predictions of that solver instead,
+      validate-classifier_<solver>.npz, and with --compare-svc, a table of how often its
+      predictions agree with the (default) svc solver, validate-classifier_<solver>-agreement.tsv
 """
 
+import argparse
+import re
+
 import numpy as np
-from sklearn.feature_extraction.text import CountVectorizer
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.linear_model import SGDClassifier
 from sklearn.model_selection import StratifiedShuffleSplit
-from sklearn.svm import SVC
+from sklearn.svm import SVC, LinearSVC
 from tqdm import tqdm
 
 import config as c
 
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--solver",
+    choices=["svc", "linearsvc", "sgd"],
+    default="svc",
+    help="Linear SVM solver. linearsvc and sgd solve the primal problem, scaling to more posts.",
+)
+parser.add_argument(
+    "--compare-svc",
+    action="store_true",
+    help="Also fit svc on each fold, and export how often the solver's predictions agree.",
+)
+parser.add_argument(
+    "-j", "--jobs", type=int, default=1, help="Number of cv folds to fit in parallel."
+)
+args = parser.parse_args()
+
 EXPORT_STEM = "validate-classifier"
+if args.solver != "svc":
+    EXPORT_STEM += f"_{args.solver}"
 export_path = c.derivatives_dir / f"{EXPORT_STEM}.npz"
 
-COLUMN_NAME = "post_lemmas"
 N_SPLITS = 5
 TRAIN_SIZE = 0.7
 NONLUCID_DIGIT = 0
 LUCID_DIGIT = 1
 
+# Select lemmas like CountVectorizer(max_df=0.75, min_df=100, max_features=5000) would
+MAX_DF = 0.75
+MIN_DF = 100
+MAX_FEATURES = 5000
+TOKEN_PATTERN = r"(?u)\b\w\w+\b"  # CountVectorizer's default
+
 # Initialize the classification pipeline components
-vectorizer = CountVectorizer(
-    max_df=0.75,
-    min_df=100,
-    ngram_range=(1, 1),
-    max_features=5000,
-    binary=False,
-)
-clf = SVC(kernel="linear", C=1.0)
+# All solvers fit a linear SVM (hinge loss), with libsvm (svc), liblinear, or SGD
+classifiers = {
+    "svc": SVC(kernel="linear", C=1.0),
+    "linearsvc": LinearSVC(C=1.0, loss="hinge", dual=True, max_iter=10_000, random_state=0),
+    "sgd": SGDClassifier(loss="hinge", random_state=0),
+}
+clf = classifiers[args.solver]
+reference_clf = classifiers["svc"] if args.compare_svc and args.solver != "svc" else None
 cv = StratifiedShuffleSplit(n_splits=N_SPLITS, train_size=TRAIN_SIZE, random_state=2)
 
-# Load data
-df = c.load_dreamviews_posts(lemmas=True)
-usecols = ["post_id", "user_id", "lucidity", COLUMN_NAME]
-df = df[usecols].set_index("post_id")
+# Load data, with lemmas only to keep the posts that have lemmas (counts come from docterm.npz)
+df = c.load_dreamviews_posts(lemmas=True, columns=["post_id", "user_id", "lucidity"])
+df = df.drop(columns="post_lemmas").set_index("post_id")
 # Drop non-lucid data
 df = df[df["lucidity"].str.contains("lucid")]
 
 # Make an effort to balance training by..
 # ...downsampling to one dream per user
-df = df.groupby("user_id").sample(n=1, replace=False, random_state=0)
+df = df.groupby("user_id", observed=True).sample(n=1, replace=False, random_state=0)
 # ...getting the minimum number of either class (LD or NLD)
-n_per_class = df["lucidity"].value_counts().min()
+n_per_class = df.groupby("lucidity", observed=True).size().min()
 # ...and downsampling both classes to this minimum amount
-df = df.groupby("lucidity").sample(n=n_per_class, replace=False, random_state=1)
-
-# Convert to vectors for training/testing
-corpus = df[COLUMN_NAME].tolist()
-X = vectorizer.fit_transform(corpus)
-y = df["lucidity"].map({"nonlucid": NONLUCID_DIGIT, "lucid": LUCID_DIGIT}).values
-
-# Cross-validation
-true_labels_list = []
-pred_labels_list = []
-for train_index, test_index in tqdm(cv.split(X, y), total=N_SPLITS, desc="Lucidity classifier"):
-    X_train, X_test = X[train_index], X[test_index]
-    y_train, y_test = y[train_index], y[test_index]
-    clf.fit(X_train, y_train)
-    y_pred = clf.predict(X_test)
-    true_labels_list.append(y_test)
-    pred_labels_list.append(y_pred)
+df = df.groupby("lucidity", observed=True).sample(n=n_per_class, replace=False, random_state=1)
+
+
+def select_features(counts, vocab):
+    """Return the columns of the counts that CountVectorizer would keep, and their lemmas.
+
+    Lemmas are kept if they'd be tokens of CountVectorizer's token pattern, in at most
+    MAX_DF of the posts and at least MIN_DF posts, and among the MAX_FEATURES most frequent.
+    """
+    is_token = np.array([re.fullmatch(TOKEN_PATTERN, lemma) is not None for lemma in vocab])
+    counts = counts[:, is_token]
+    vocab = vocab[is_token]
+    dfs = np.bincount(counts.indices, minlength=counts.shape[1])
+    mask = (dfs <= MAX_DF * counts.shape[0]) & (dfs >= MIN_DF)
+    if mask.sum() > MAX_FEATURES:
+        tfs = np.asarray(counts.sum(axis=0)).ravel()
+        mask_inds = (-tfs[mask]).argsort()[:MAX_FEATURES]
+        new_mask = np.zeros(len(dfs), dtype=bool)
+        new_mask[np.where(mask)[0][mask_inds]] = True
+        mask = new_mask
+    return counts[:, mask], vocab[mask]
+
+
+# Select the counts of the sampled posts for training/testing
+doc_term = c.load_doc_term_matrix()
+rows = pd.Index(doc_term["post_ids"]).get_indexer(df.index)
+assert (rows >= 0).all(), "Posts missing from the document-term matrix, rerun generate-docterm.py"
+X, _ = select_features(doc_term["counts"][rows], doc_term["vocab"])
+# Unused categories (e.g., ambiguous) map to NaN, so cast the labels back to integers
+y = df["lucidity"].map({"nonlucid": NONLUCID_DIGIT, "lucid": LUCID_DIGIT}).astype(int).to_numpy()
+
+
+def fit_fold(clf, X, y, train_index, test_index):
+    """Return the predictions of a copy of the classifier on one cv fold."""
+    clf = clone(clf)
+    clf.fit(X[train_index], y[train_index])
+    return clf.predict(X[test_index])
+
+
+# Cross-validation, with folds (and svc for comparison) fitted in parallel.
+# X and y are passed to workers as memory-mapped files, written once rather than once per
+# task (max_nbytes=0 memory-maps all arrays, including those of the sparse X),
+# and results come back in the order of the folds.
+folds = list(cv.split(X, y))
+classifiers_to_fit = [clf] if reference_clf is None else [clf, reference_clf]
+tasks = [(fold_clf, *fold) for fold in folds for fold_clf in classifiers_to_fit]
+parallel = Parallel(n_jobs=args.jobs, max_nbytes=0, return_as="generator")
+predictions = parallel(delayed(fit_fold)(task_clf, X, y, *fold) for task_clf, *fold in tasks)
+predictions = list(tqdm(predictions, total=len(tasks), desc="Lucidity classifier"))
+true_labels_list = [y[test_index] for _, test_index in folds]
+pred_labels_list = predictions[:: len(classifiers_to_fit)]
+reference_labels_list = predictions[1 :: len(classifiers_to_fit)]
 cv_true_labels = np.vstack(true_labels_list)
 cv_pred_labels = np.vstack(pred_labels_list)
 
 # Export
 np.savez(export_path, true_labels=cv_true_labels, predicted_labels=cv_pred_labels)
+
+# Compare predictions of other solvers to those of svc, at each cv fold
+if reference_clf is not None:
+    cv_reference_labels = np.vstack(reference_labels_list)
+    agreement = pd.DataFrame(
+        {
+            "agreement": (cv_pred_labels == cv_reference_labels).mean(axis=1),
+            f"accuracy_{args.solver}": (cv_pred_labels == cv_true_labels).mean(axis=1),
+            "accuracy_svc": (cv_reference_labels == cv_true_labels).mean(axis=1),
+        }
+    ).rename_axis("cv")
+    agreement.index += 1
+    print(agreement.round(3).to_string())
+    c.export_table(agreement, f"{EXPORT_STEM}-agreement")
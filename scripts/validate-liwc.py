@@ -77,7 +77,7 @@ if GET_WORD_CONTRIBUTIONS:
     export_fname_attr = c.derivatives_dir / f"{EXPORT_STEM}_attr.npz"
 
 # Load data
-df = c.load_dreamviews_posts()
+df = c.load_dreamviews_posts(columns=["post_id", "post_text"])
 ser = df.set_index("post_id")["post_text"]
 
 # Load LIWC parser, which takes a single token and finds all LIWC categories it's a part of
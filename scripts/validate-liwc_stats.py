@@ -32,7 +32,7 @@ export_stem_stats = f"{EXPORT_STEM}_stats"
 ########################## I/O
 
 # merge the clean data file and all its attributes with the liwc results
-df = c.load_dreamviews_posts()
+df = c.load_dreamviews_posts(columns=["post_id", "user_id", "lucidity"])
 df_attr = df.set_index("post_id")
 df_liwc = pd.read_csv(import_path_liwc, index_col="post_id", sep="\t", encoding="utf-8")
 df = df_attr.join(df_liwc, how="inner")
@@ -41,11 +41,11 @@ assert len(df) == len(df_attr) == len(df_liwc), "Should all be same length after
 # Average the LD and NLD scores for each user
 # Users without both dream types will be removed
 avgs = (
-    df.groupby(["user_id", "lucidity"])[LIWC_CATS]
+    df.groupby(["user_id", "lucidity"], observed=True)[LIWC_CATS]
     .mean()
     .drop(["ambiguous", "unspecified"], level="lucidity")
     .rename_axis(columns="category")
-    .pivot_table(index="user_id", columns="lucidity")
+    .pivot_table(index="user_id", columns="lucidity", observed=True)
     .dropna()
     .multiply(100)
 )  # convert to percentages
@@ -54,7 +54,7 @@ EXPORT_STEM = "validate-liwc_words"
 #### load in the original posts file to get attributes lucidity and user_id
 # and drop un-labeled posts
 # merge the clean data file and all its attributes with the liwc results
-posts = c.load_dreamviews_posts()
+posts = c.load_dreamviews_posts(columns=["post_id", "user_id", "lucidity"])
 posts = posts.set_index("post_id")[["user_id", "lucidity"]]
 posts = posts[posts["lucidity"].str.contains("lucid")]
 
@@ -94,10 +94,10 @@ assert len(df) == len(posts)
 # Average the LD and NLD scores of each token for each user
 # Some users might not have both dream types and they'll be removed
 avgs = (
-    df.groupby(["user_id", "lucidity"])
+    df.groupby(["user_id", "lucidity"], observed=True)
     .mean()
     .rename_axis(columns="token")
-    .pivot_table(index="user_id", columns="lucidity")
+    .pivot_table(index="user_id", columns="lucidity", observed=True)
     .dropna()
 )
 
@@ -9,10 +9,12 @@ Some users include 1000 posts, others 1. Word frequencies are
 normalized to account for this, before being passed to shifterator.
 
 Bigrams are included in the wordshift by first transforming text with gensim.
+Without bigrams, word frequencies are counted from the document-term matrix instead.
 
 IMPORTS
 =======
     - lemmatized posts, dreamviews-posts.tsv
+    - post x lemma counts (only without bigrams), docterm.npz
 EXPORTS
 =======
     - raw JSD shift scores for lucidity,          validate-wordshift_jsd.tsv
@@ -27,6 +29,7 @@ EXPORTS
 import argparse
 
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import shifterator as sh
 from gensim.models.phrases import Phraser, Phrases
@@ -73,7 +76,9 @@ export_path_jsd_plot = (c.figures_dir / f"{export_stem_jsd}_src").with_suffix(".
 export_path_fear_plot = (c.figures_dir / f"{export_stem_fear}_src").with_suffix(".png")
 
 # Load data
-df = c.load_dreamviews_posts(lemmas=True)
+df = c.load_dreamviews_posts(lemmas=True, columns=["post_id", "user_id", "lucidity", "nightmare"])
+if NO_BIGRAMS:
+    doc_term = c.load_doc_term_matrix()
 
 ########################################################################################
 # CONNECT BIGRAMS
@@ -119,12 +124,12 @@ if not NO_BIGRAMS:  # Sorry for the double negative
 
 # Extract lucidity Series for JSD and proportion shifts
 ld_ser = df.query("lucidity.str.contains('lucid')", engine="python").set_index(
-    ["lucidity", "user_id"]
+    ["lucidity", "user_id", "post_id"]
 )[COLUMN_NAME]
 
 # Export nightmare Series for NRC-fear shift
 df["nightmare"] = df["nightmare"].map({True: "nightmare", False: "nonnightmare"})
-nm_ser = df.set_index(["nightmare", "user_id"])[COLUMN_NAME]
+nm_ser = df.set_index(["nightmare", "user_id", "post_id"])[COLUMN_NAME]
 
 ########################################################################################
 # NORMALIZATION FUNCTIONS
@@ -179,15 +184,15 @@ def get_normed_freqs(series, group1, group2):
     Then *those* are added across the corpus, instead of raw counts.
     """
     # Get post frequency per user, for each corpus
-    user2freq_1 = series.loc[group1].groupby("user_id").size()
-    user2freq_2 = series.loc[group2].groupby("user_id").size()
+    user2freq_1 = series.loc[group1].groupby("user_id", observed=True).size()
+    user2freq_2 = series.loc[group2].groupby("user_id", observed=True).size()
 
     # Get n-gram frequencies per user, for each corpus
     ngram_ser = series.str.lower().str.split().explode()
     ngrams_1 = ngram_ser.loc[group1]
     ngrams_2 = ngram_ser.loc[group2]
-    userngrams2freq_1 = ngrams_1.groupby("user_id").value_counts()
-    userngrams2freq_2 = ngrams_2.groupby("user_id").value_counts()
+    userngrams2freq_1 = ngrams_1.groupby("user_id", observed=True).value_counts()
+    userngrams2freq_2 = ngrams_2.groupby("user_id", observed=True).value_counts()
 
     # Normalize each n-gram frequency for each user, for each corpus
     userngrams2norm_1 = (
@@ -202,6 +207,32 @@ def get_normed_freqs(series, group1, group2):
     return ngram2freq_1, ngram2freq_2
 
 
+def get_doc_term_freqs(series, group1, group2, normed=True):
+    """
+    Return word frequencies like get_simple_freqs or get_normed_freqs (if normed),
+    but from the document-term matrix, as sums of each post's counts weighted by
+    1 over the amount of posts its user contributed (or 1 if not normed).
+    Only for unigrams, since the document-term matrix doesn't include bigrams.
+    """
+    doc_term_rows = pd.Index(doc_term["post_ids"])
+    ngram2freqs = []
+    for group in [group1, group2]:
+        group_index = series.loc[group].index
+        rows = doc_term_rows.get_indexer(group_index.get_level_values("post_id"))
+        assert (rows >= 0).all(), (
+            "Posts missing from the document-term matrix, rerun generate-docterm.py"
+        )
+        weights = np.ones(len(rows), dtype=np.int64)
+        if normed:
+            user_codes, _ = pd.factorize(group_index.get_level_values("user_id"))
+            weights = 1 / np.bincount(user_codes)[user_codes]
+        freqs = doc_term["counts"][rows].T @ weights
+        nonzero = np.flatnonzero(freqs)
+        ngrams = doc_term["vocab"][nonzero].tolist()
+        ngram2freqs.append(dict(zip(ngrams, freqs[nonzero].tolist(), strict=True)))
+    return tuple(ngram2freqs)
+
+
 ########################################################################################
 # CALCULATE AND PLOT WORDSHIFTS
 ########################################################################################
@@ -212,7 +243,11 @@ def get_normed_freqs(series, group1, group2):
 # Get frequencies
 NM_GROUP1 = "nonnightmare"
 NM_GROUP2 = "nightmare"
-if NO_NORMING:
+if NO_BIGRAMS:
+    ngram2freq_1, ngram2freq_2 = get_doc_term_freqs(
+        nm_ser, NM_GROUP1, NM_GROUP2, normed=not NO_NORMING
+    )
+elif NO_NORMING:
     ngram2freq_1, ngram2freq_2 = get_simple_freqs(nm_ser, NM_GROUP1, NM_GROUP2)
 else:
     ngram2freq_1, ngram2freq_2 = get_normed_freqs(nm_ser, NM_GROUP1, NM_GROUP2)
@@ -246,7 +281,11 @@ c.export_table(out_df, export_stem_fear, float_format=FLOAT_FORMAT)
 # Get frequencies
 LD_GROUP1 = "nonlucid"
 LD_GROUP2 = "lucid"
-if NO_NORMING:
+if NO_BIGRAMS:
+    ngram2freq_1, ngram2freq_2 = get_doc_term_freqs(
+        ld_ser, LD_GROUP1, LD_GROUP2, normed=not NO_NORMING
+    )
+elif NO_NORMING:
     ngram2freq_1, ngram2freq_2 = get_simple_freqs(ld_ser, LD_GROUP1, LD_GROUP2)
 else:
     ngram2freq_1, ngram2freq_2 = get_normed_freqs(ld_ser, LD_GROUP1, LD_GROUP2)